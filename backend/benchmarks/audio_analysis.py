@@ -0,0 +1,66 @@
+"""
+Measure the throughput of the upload-time audio analysis.
+
+A synthetic stereo WAV is written in chunks, then analysed block by block.
+Peak RSS is reported next to the file size to show that memory use does not
+grow with the length of the track.
+
+Usage (from the backend directory):
+    python -m benchmarks.audio_analysis --duration 600 --sample-rate 96000 --bit-depth 24
+"""
+import argparse
+import resource
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.audio_analysis import analyze_wav
+
+
+def make_wav(path: Path, duration: int, sample_rate: int, bit_depth: int):
+    rng = np.random.default_rng(0)
+    with wave.open(path.as_posix(), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(bit_depth // 8)
+        wav.setframerate(sample_rate)
+        for start in range(0, duration * sample_rate, sample_rate):
+            t = np.arange(start, start + sample_rate) / sample_rate
+            signal = 0.5 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+            samples = np.round(np.repeat(signal[:, None], 2, axis=1) * (2 ** (bit_depth - 1) - 1)).astype("<i4")
+            if bit_depth == 16:
+                data = samples.astype("<i2").tobytes()
+            else:
+                data = samples.view(np.uint8).reshape(-1, 2, 4)[..., :3].tobytes()
+            wav.writeframes(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=600, help="WAV length in seconds")
+    parser.add_argument("--sample-rate", type=int, default=96000)
+    parser.add_argument("--bit-depth", type=int, choices=(16, 24), default=24)
+    parser.add_argument("--block-frames", type=int, default=1 << 18)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp)/"source.wav"
+        make_wav(path, args.duration, args.sample_rate, args.bit_depth)
+        size_mb = path.stat().st_size / 2**20
+        print(f"source: {args.duration}s, {args.sample_rate} Hz, {args.bit_depth} bit, {size_mb:.1f} MB")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        analysis = analyze_wav(path, block_frames=args.block_frames)
+        elapsed = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"analysis: {analysis}")
+    print(f"wall: {elapsed:.2f} s, throughput: {size_mb / elapsed:.1f} MB/s")
+    print(f"peak RSS: {rss_after / 1024:.1f} MB (+{(rss_after - rss_before) / 1024:.1f} MB during analysis)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Check that the hot queries of the API are answered from an index.
+
+Every query is explained against the configured database and its winning
+plan is printed. The script exits with status 1 if any plan scans a whole
+collection, so it can gate a deploy.
+
+Usage (from the backend directory, with access to the database):
+    python -m benchmarks.index_coverage --ensure
+"""
+import argparse
+import asyncio
+import sys
+
+from src.db.client import db
+from src.db.indexes import ensure_indexes
+
+hot_queries = [
+    ("processed_requests", {"username": "user"}, [("date", -1)]),
+    ("release_requests", {"status": "pending", "in_delivery_sheet": False}, None),
+    ("release_requests", {"username": "user"}, [("_id", -1)]),
+    ("release_requests", {}, [("date", -1), ("_id", -1)]),
+    ("delivery_jobs", {"release_id": "release", "status": {"$in": ["queued", "running"]}}, None),
+    ("delivery_jobs", {"status": {"$in": ["queued", "running"]}}, [("created_at", 1)]),
+    ("pending_sheet_rows", {"worksheet": "Test"}, [("_id", 1)]),
+    ("files", {"upload_datetime": {"$lt": "2000-01-01 00:00:00.000000"}}, None),
+]
+
+
+def plan_stages(plan: dict) -> list[str]:
+    stages = [plan.get("stage", "")]
+    if plan.get("indexName"):
+        stages[0] += f"({plan['indexName']})"
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+
+async def check(ensure: bool) -> bool:
+    if ensure:
+        await ensure_indexes()
+
+    covered = True
+    for collection_name, query, sort in hot_queries:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.limit(50).explain()
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+        scan = any(stage.startswith("COLLSCAN") for stage in stages)
+        covered = covered and not scan
+        print(f"{'COLLSCAN' if scan else 'ok':<10}{collection_name:<20}{query} sort={sort}: {' <- '.join(stages)}")
+    return covered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ensure", action="store_true", help="create missing indexes before checking")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(check(args.ensure)) else 1)
+
+
+if __name__ == "__main__":
+    main()
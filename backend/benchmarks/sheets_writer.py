@@ -0,0 +1,54 @@
+"""
+Compare the old row-by-row Google Sheets writer with the batched append writer.
+
+Both run against the in-memory spreadsheet, with a fixed latency per API
+request standing in for the Sheets round trip.
+
+Usage (from the backend directory):
+    python -m benchmarks.sheets_writer --releases 20 --tracks 15 --latency 0.2
+"""
+import argparse
+import time
+
+from src.utils.google_sheets import InMemorySpreadsheet, write_rows_to_google_sheet
+
+
+def write_rows_one_by_one(spreadsheet: InMemorySpreadsheet, worksheet_name: str, rows: list[list]):
+    sheet = spreadsheet.worksheet(worksheet_name)
+    first_empty_row = len(sheet.col_values(1)) + 1
+    for row in rows:
+        sheet.insert_row(row, index=first_empty_row)
+        first_empty_row += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--releases", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=15, help="rows per release")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per API request")
+    args = parser.parse_args()
+
+    releases = [
+        [[f"release {release}", f"track {track}", *["" for _ in range(42)]] for track in range(args.tracks)]
+        for release in range(args.releases)
+    ]
+
+    print(f"{args.releases} releases x {args.tracks} rows, {args.latency}s per request")
+    print(f"{'writer':<14}{'requests':>10}{'wall, s':>10}{'rows':>8}")
+
+    writers = (
+        ("row by row", lambda spreadsheet, rows: write_rows_one_by_one(spreadsheet, "Test", rows)),
+        ("batched", lambda spreadsheet, rows: write_rows_to_google_sheet("Test", rows, spreadsheet=spreadsheet)),
+    )
+    for name, write in writers:
+        spreadsheet = InMemorySpreadsheet(latency=args.latency)
+        start = time.perf_counter()
+        for rows in releases:
+            write(spreadsheet, rows)
+        elapsed = time.perf_counter() - start
+        sheet = spreadsheet.worksheet("Test")
+        print(f"{name:<14}{sheet.requests:>10}{elapsed:>10.2f}{len(sheet.rows):>8}")
+
+
+if __name__ == "__main__":
+    main()
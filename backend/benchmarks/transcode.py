@@ -0,0 +1,74 @@
+"""
+Compare the old pydub WAV -> MP3 conversion with the streaming ffmpeg engine.
+
+Every conversion runs in a fresh process, so peak RSS is not polluted by
+previous runs. Python and ffmpeg peaks are reported separately.
+
+Usage (from the backend directory, ffmpeg and pydub required):
+    python -m benchmarks.transcode --duration 600 --sample-rate 96000 --bit-depth 24
+"""
+import argparse
+import multiprocessing
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+PCM_CODECS = {16: "pcm_s16le", 24: "pcm_s24le", 32: "pcm_s32le"}
+
+
+def make_wav(path: Path, duration: int, sample_rate: int, bit_depth: int):
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate={sample_rate}:duration={duration}",
+        "-ac", "2", "-c:a", PCM_CODECS[bit_depth], path.as_posix(),
+    ], check=True)
+
+
+def convert_pydub(src_path: Path, dst_path: Path):
+    from pydub import AudioSegment
+    AudioSegment.from_wav(src_path).export(dst_path, format="mp3")
+
+
+def convert_engine(src_path: Path, dst_path: Path):
+    from src.utils.transcoding import transcode_to_mp3
+    transcode_to_mp3(src_path, dst_path)
+
+
+def measure(convert, src_path: Path, dst_path: Path, results: multiprocessing.Queue):
+    start = time.perf_counter()
+    convert(src_path, dst_path)
+    elapsed = time.perf_counter() - start
+    python_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ffmpeg_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    results.put((elapsed, python_rss, ffmpeg_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=int, default=600, help="WAV length in seconds")
+    parser.add_argument("--sample-rate", type=int, default=96000)
+    parser.add_argument("--bit-depth", type=int, choices=PCM_CODECS, default=24)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src_path = Path(tmp)/"source.wav"
+        make_wav(src_path, args.duration, args.sample_rate, args.bit_depth)
+        size_mb = src_path.stat().st_size / 2**20
+        print(f"source: {args.duration}s, {args.sample_rate} Hz, {args.bit_depth} bit, {size_mb:.1f} MB")
+        print(f"{'implementation':<16}{'wall, s':>10}{'python RSS, MB':>18}{'ffmpeg RSS, MB':>18}")
+
+        for name, convert in (("pydub", convert_pydub), ("ffmpeg stream", convert_engine)):
+            results = context.Queue()
+            process = context.Process(target=measure, args=(convert, src_path, Path(tmp)/f"{name}.mp3", results))
+            process.start()
+            elapsed, python_rss, ffmpeg_rss = results.get()
+            process.join()
+            print(f"{name:<16}{elapsed:>10.2f}{python_rss / 1024:>18.1f}{ffmpeg_rss / 1024:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
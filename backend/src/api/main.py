@@ -1,11 +1,41 @@
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, UploadFile, Form
 from typing import List
 from pydantic import BaseModel, ValidationError
+from loguru import logger
 
+from ..db.client import db
+from ..db.indexes import ensure_indexes
 from ..routers import release_router, user_router, file_router, user_data_router
+from ..utils.delivery import delivery_queue
+from ..utils.sheet_buffer import sheet_buffer
+from ..utils.storage import storage_manager
+from ..utils.transcoding import shutdown_executor
+from ..utils.yandex_disk import async_yadisk
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db.connect()
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        # the API still works without the indexes, only slower
+        logger.exception(e)
+    await sheet_buffer.start()
+    await delivery_queue.start()
+    await storage_manager.start()
+    yield
+    await storage_manager.stop()
+    await delivery_queue.stop()
+    await sheet_buffer.stop()
+    await async_yadisk.close()
+    shutdown_executor()
+    db.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
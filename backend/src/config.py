@@ -1,5 +1,65 @@
+import os
 from pathlib import Path
 
 
 download_dir = Path(__file__).parent.parent/'data'
-temp_dir = Path(__file__).parent.parent/'temp'
\ No newline at end of file
+temp_dir = Path(__file__).parent.parent/'temp'
+
+mongo_backend = os.environ.get('MONGO_BACKEND', 'mongo')
+# the connection string carries the credentials, so it only ever comes from the environment
+mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+mongo_database = os.environ.get('MONGO_DATABASE', 'main_database')
+mongo_max_pool_size = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+mongo_min_pool_size = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+mongo_connect_timeout_ms = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 20000))
+mongo_server_selection_timeout_ms = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000))
+mongo_socket_timeout_ms = int(os.environ['MONGO_SOCKET_TIMEOUT_MS']) if 'MONGO_SOCKET_TIMEOUT_MS' in os.environ else None
+mongo_read_preference = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+# e.g. "zstd,snappy,zlib", zstd and snappy need their python packages
+mongo_compressors = os.environ.get('MONGO_COMPRESSORS')
+
+delivery_workers = int(os.environ.get('DELIVERY_WORKERS', 2))
+delivery_track_concurrency = int(os.environ.get('DELIVERY_TRACK_CONCURRENCY', 4))
+
+transcode_workers = int(os.environ.get('TRANSCODE_WORKERS', os.cpu_count() or 1))
+mp3_profile = os.environ.get('MP3_PROFILE', 'standard')
+mp3_bitrate = os.environ.get('MP3_BITRATE')
+preview_duration = float(os.environ.get('PREVIEW_DURATION', 30))
+
+sheets_backend = os.environ.get('GOOGLE_SHEETS_BACKEND', 'google')
+sheets_flush_rows = int(os.environ.get('SHEETS_FLUSH_ROWS', 50))
+sheets_flush_interval = float(os.environ.get('SHEETS_FLUSH_INTERVAL', 10))
+sheets_max_attempts = int(os.environ.get('SHEETS_MAX_ATTEMPTS', 3))
+
+yadisk_backend = os.environ.get('YADISK_BACKEND', 'yandex')
+yadisk_local_root = Path(os.environ.get('YADISK_LOCAL_ROOT', Path(__file__).parent.parent/'yadisk'))
+yadisk_pool_size = int(os.environ.get('YADISK_POOL_SIZE', 10))
+yadisk_timeout = float(os.environ.get('YADISK_TIMEOUT', 30))
+yadisk_upload_timeout = float(os.environ.get('YADISK_UPLOAD_TIMEOUT', 600))
+yadisk_cache_ttl = float(os.environ.get('YADISK_CACHE_TTL', 3600))
+yadisk_cache_persistent_ttl = float(os.environ.get('YADISK_CACHE_PERSISTENT_TTL', 30 * 24 * 3600))
+
+# 0 disables the quota
+storage_quota = int(os.environ.get('STORAGE_QUOTA', 0))
+storage_gc_interval = float(os.environ.get('STORAGE_GC_INTERVAL', 3600))
+storage_orphan_grace = float(os.environ.get('STORAGE_ORPHAN_GRACE', 7 * 24 * 3600))
+# report what a sweep would delete without deleting it
+storage_gc_dry_run = os.environ.get('STORAGE_GC_DRY_RUN', '0') == '1'
+temp_max_age = float(os.environ.get('TEMP_MAX_AGE', 2 * 24 * 3600))
+
+download_cache_size = int(os.environ.get('DOWNLOAD_CACHE_SIZE', 4096))
+download_cache_ttl = float(os.environ.get('DOWNLOAD_CACHE_TTL', 3600))
+
+upload_size_limits = {
+    'wav': 2 * 1024**3,
+    'mp4': 4 * 1024**3,
+    'mov': 4 * 1024**3,
+    'jpeg': 50 * 1024**2,
+    'jpg': 50 * 1024**2,
+    'png': 50 * 1024**2,
+    'bmp': 50 * 1024**2,
+    'tiff': 50 * 1024**2,
+    'gif': 50 * 1024**2,
+    'docx': 20 * 1024**2,
+}
+upload_size_limit_default = int(os.environ.get('UPLOAD_SIZE_LIMIT_DEFAULT', 100 * 1024**2))
@@ -0,0 +1,97 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from .client import db
+from .utils import change_mongo_id_to_str
+
+delivery_jobs = db['delivery_jobs']
+
+indexes = {
+    'delivery_jobs': [
+        IndexModel([('release_id', ASCENDING), ('status', ASCENDING)], name='release_id_status'),
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)], name='status_created_at'),
+        # set only while a job is queued or running, so a release has at most one active job
+        IndexModel([('active_release_id', ASCENDING)], name='active_release_id', unique=True, sparse=True),
+    ],
+}
+
+
+async def add_delivery_job(release_id: str) -> tuple[str, bool]:
+    """
+    Queue a delivery job for the release unless one is already queued or running.
+
+    Returns:
+        tuple[str, bool]: Id of the new or of the active job and whether the job was created.
+    """
+    job = {
+        'release_id': release_id,
+        'status': 'queued',
+        'created_at': datetime.utcnow(),
+        'started_at': None,
+        'finished_at': None,
+        'steps': [],
+        'error': None,
+    }
+    while True:
+        try:
+            result = await delivery_jobs.update_one({'active_release_id': release_id}, {'$setOnInsert': job}, upsert=True)
+            if result.upserted_id is not None:
+                return str(result.upserted_id), True
+        except DuplicateKeyError:
+            # a concurrent request inserted the job first
+            pass
+        active_job = await delivery_jobs.find_one({'active_release_id': release_id}, {'_id': 1})
+        # otherwise the active job finished in between and the insert is retried
+        if active_job is not None:
+            return str(active_job['_id']), False
+
+
+async def get_delivery_job_by_id(id: str) -> dict | None:
+    try:
+        result = await delivery_jobs.find_one({"_id": ObjectId(id)})
+    except:
+        return None
+    if result is None:
+        return None
+    job = change_mongo_id_to_str([result])
+    return job[0]
+
+
+async def get_unfinished_delivery_jobs() -> list[str]:
+    result = await delivery_jobs.find({"status": {"$in": ['queued', 'running']}}, {"_id": 1}).sort("created_at", 1).to_list(None)
+    return [str(job['_id']) for job in result]
+
+
+async def update_delivery_job(id: str, data: dict):
+    await delivery_jobs.update_one({"_id": ObjectId(id)}, {"$set": data})
+
+
+async def finish_delivery_job(id: str, status: str, error: str | None = None):
+    await delivery_jobs.update_one(
+        {"_id": ObjectId(id)},
+        {"$set": {"status": status, "finished_at": datetime.utcnow(), "error": error}, "$unset": {"active_release_id": ""}}
+    )
+
+
+async def add_delivery_job_step(id: str, name: str, status: str = 'running'):
+    now = datetime.utcnow()
+    step = {
+        'name': name,
+        'status': status,
+        'started_at': now,
+        'finished_at': None if status == 'running' else now,
+        'error': None,
+    }
+    await delivery_jobs.update_one({"_id": ObjectId(id)}, {"$push": {"steps": step}})
+
+
+async def finish_delivery_job_step(id: str, name: str, status: str, error: str | None = None):
+    await delivery_jobs.update_one(
+        {"_id": ObjectId(id), "steps.name": name},
+        {"$set": {
+            "steps.$.status": status,
+            "steps.$.finished_at": datetime.utcnow(),
+            "steps.$.error": error,
+        }}
+    )
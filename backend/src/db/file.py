@@ -1,7 +1,42 @@
+from datetime import datetime
 from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, ReturnDocument
 from .utils import change_mongo_id_to_str
 from .client import db
+from .release_requests import processed_requests, release_requests
+from .user_data import user_data, user_data_versions
 files = db['files']
+file_blobs = db['file_blobs']
+
+# fields holding file ids, by collection; lists along a path are walked like Mongo does
+passport_scan_paths = [
+    f'{passport}_passport.{page}_page_scan_id'
+    for passport in ('ru', 'kz', 'by', 'foreign')
+    for page in ('first', 'second')
+]
+release_file_paths = [
+    'data.cover_file_id',
+    'data.video_file_id',
+    'data.tracks.wav_file_id',
+    'data.tracks.text_file_id',
+    # contract scans of authors are stored as a bare file id instead of their docs
+    'authors.data',
+    # requests made before user data was versioned embed the whole copy
+    *(f'user_data.{path}' for path in passport_scan_paths),
+]
+file_reference_paths = [
+    (release_requests, release_file_paths),
+    (processed_requests, release_file_paths),
+    (user_data, passport_scan_paths),
+    (user_data_versions, [f'data.{path}' for path in passport_scan_paths]),
+]
+
+indexes = {
+    'files': [
+        IndexModel([('upload_datetime', ASCENDING)], name='upload_datetime'),
+    ],
+    'file_blobs': [],
+}
 
 
 async def add_file(file: dict) -> str:
@@ -18,3 +53,92 @@ async def get_file_by_id(id: str) -> dict | None:
         return None
     file = change_mongo_id_to_str([result])
     return file[0]
+
+
+async def delete_file(id: str):
+    await files.delete_one({"_id": ObjectId(id)})
+
+
+async def update_file(id: str, data: dict):
+    await files.update_one({"_id": ObjectId(id)}, {"$set": data})
+
+
+async def mark_file_released(id: str) -> dict | None:
+    """
+    Mark the local copy of a file as removed. Returns the file only for the first call.
+    """
+    result = await files.find_one_and_update(
+        {"_id": ObjectId(id), "released": {"$ne": True}},
+        {"$set": {"released": True}},
+    )
+    if result is None:
+        return None
+    file = change_mongo_id_to_str([result])
+    return file[0]
+
+
+async def add_blob_reference(sha256: str, extension: str, size: int) -> int:
+    result = await file_blobs.find_one_and_update(
+        {"_id": sha256},
+        {
+            "$inc": {"ref_count": 1},
+            "$setOnInsert": {"extension": extension, "size": size, "created_at": datetime.utcnow()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return result['ref_count']
+
+
+async def remove_blob_reference(sha256: str) -> int:
+    result = await file_blobs.find_one_and_update(
+        {"_id": sha256},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if result is None:
+        return 0
+    if result['ref_count'] <= 0:
+        await file_blobs.delete_one({"_id": sha256, "ref_count": {"$lte": 0}})
+    return result['ref_count']
+
+
+def _collect_file_ids(value, keys: list[str], ids: set[str]):
+    if isinstance(value, list):
+        for item in value:
+            _collect_file_ids(item, keys, ids)
+    elif not keys:
+        # other values at a file path are documents, such as the docs of an author
+        if isinstance(value, str) and value:
+            ids.add(value)
+    elif isinstance(value, dict):
+        _collect_file_ids(value.get(keys[0]), keys[1:], ids)
+
+
+async def get_referenced_file_ids() -> set[str]:
+    """
+    Ids of all files referenced by release requests, processed requests and user data.
+    """
+    ids = set()
+    for collection, paths in file_reference_paths:
+        async for document in collection.find({}, {path: 1 for path in paths}):
+            for path in paths:
+                _collect_file_ids(document, path.split('.'), ids)
+    return ids
+
+
+async def iter_files_uploaded_before(upload_datetime: str):
+    cursor = files.find({"upload_datetime": {"$lt": upload_datetime}}, {"extension": 1, "sha256": 1, "released": 1})
+    async for file in cursor:
+        yield change_mongo_id_to_str([file])[0]
+
+
+async def get_existing_file_ids(ids: list[str]) -> set[str]:
+    object_ids = [ObjectId(id) for id in ids if ObjectId.is_valid(id)]
+    result = await files.find({"_id": {"$in": object_ids}}, {"_id": 1}).to_list(None)
+    return {str(file['_id']) for file in result}
+
+
+async def get_existing_blob_ids(sha256s: list[str]) -> set[str]:
+    result = await file_blobs.find({"_id": {"$in": sha256s}}, {"_id": 1}).to_list(None)
+    return {blob['_id'] for blob in result}
@@ -0,0 +1,50 @@
+from loguru import logger
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from .client import db
+from . import delivery_jobs, file, release_requests, sheet_rows, user, user_data, yadisk_cache
+
+index_registry: dict[str, list[IndexModel]] = {
+    **user.indexes,
+    **user_data.indexes,
+    **file.indexes,
+    **release_requests.indexes,
+    **delivery_jobs.indexes,
+    **sheet_rows.indexes,
+    **yadisk_cache.indexes,
+}
+
+
+async def ensure_indexes() -> dict[str, dict[str, list[str]]]:
+    """
+    Create the indexes declared in index_registry that are missing. Safe to run on every start.
+    Indexes found in the database but not declared are reported, never dropped.
+
+    Returns:
+        dict: Names of the created, extra and conflicting indexes of every collection.
+    """
+    report = {}
+    for collection_name, models in index_registry.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = {model.document['name'] for model in models}
+        missing = [model for model in models if model.document['name'] not in existing]
+
+        created, conflicts = [], []
+        for model in missing:
+            try:
+                await collection.create_indexes([model])
+                created.append(model.document['name'])
+            except OperationFailure as e:
+                # usually the same keys under another name, or the same name with other options
+                logger.error(f"Index {collection_name}.{model.document['name']} not created: {e}")
+                conflicts.append(model.document['name'])
+
+        extra = sorted(set(existing) - declared - {'_id_'})
+        report[collection_name] = {'created': created, 'extra': extra, 'conflicts': conflicts}
+        if created:
+            logger.info(f"Created indexes on {collection_name}: {', '.join(created)}")
+        if extra:
+            logger.warning(f"Undeclared indexes on {collection_name}: {', '.join(extra)}")
+    return report
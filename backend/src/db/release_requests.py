@@ -1,10 +1,25 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
 from .client import db
 from .utils import change_mongo_id_to_str
 
 release_requests = db['release_requests']
 processed_requests = db['processed_requests']
 
+indexes = {
+    'release_requests': [
+        IndexModel([('status', ASCENDING), ('in_delivery_sheet', ASCENDING)], name='status_in_delivery_sheet'),
+        IndexModel([('username', ASCENDING), ('_id', DESCENDING)], name='username_created'),
+        IndexModel([('date', DESCENDING), ('_id', DESCENDING)], name='date_created'),
+    ],
+    'processed_requests': [
+        IndexModel([('username', ASCENDING), ('date', DESCENDING)], name='username_date'),
+    ],
+}
+
 
 async def add_release_request(release_request: dict):
     result = await release_requests.insert_one(release_request)
@@ -12,8 +27,9 @@ async def add_release_request(release_request: dict):
 
 
 async def add_processed_request(release_request: dict):
-    result = await processed_requests.insert_one(release_request)
-    return result.inserted_id
+    # a release delivered again replaces its previous processed copy
+    await processed_requests.replace_one({"_id": release_request['_id']}, release_request, upsert=True)
+    return release_request['_id']
 
 
 async def get_processed_requests(username: str):
@@ -22,6 +38,19 @@ async def get_processed_requests(username: str):
     return requests
 
 
+async def get_latest_processed_request(username: str) -> dict | None:
+    """
+    Get the user data reference of the user's processed request with the latest release date.
+    Release dates are ISO strings, so the username_date index serves the sort.
+    Requests made before user data was versioned carry the whole user_data instead.
+    """
+    result = await processed_requests.find_one({"username": username}, {"user_data_version": 1, "user_data": 1, "date": 1}, sort=[("date", DESCENDING)])
+    if result is None:
+        return None
+    request = change_mongo_id_to_str([result])
+    return request[0]
+
+
 async def get_processed_request(id: str):
     result = await processed_requests.find_one({"_id": id})
     if result is None:
@@ -30,10 +59,71 @@ async def get_processed_request(id: str):
     return request[0]
 
 
-async def get_release_requests():
-    result = await release_requests.find().to_list(None)
+# fields the admin list needs, without the user data snapshot, authors and tracks
+release_request_summary_projection = {
+    "username": 1, "date": 1, "imprint": 1, "type": 1, "status": 1, "cloud_link": 1,
+    "in_delivery_sheet": 1, "in_docs_sheet": 1,
+    "data.performers": 1, "data.title": 1, "data.version": 1, "data.genre": 1,
+}
+release_request_sort_fields = {"created": "_id", "date": "date"}
+
+
+def encode_release_requests_cursor(value, id: ObjectId) -> str:
+    return urlsafe_b64encode(json.dumps([value, str(id)]).encode()).decode()
+
+
+def decode_release_requests_cursor(cursor: str) -> tuple:
+    value, id = json.loads(urlsafe_b64decode(cursor.encode()))
+    return value, ObjectId(id)
+
+
+async def get_release_requests(filters: dict | None = None, sort: str = "created", ascending: bool = False,
+                               limit: int = 50, cursor: str | None = None, summary: bool = True) -> tuple[list[dict], str | None]:
+    """
+    Get one page of release requests.
+
+    Args:
+        filters (dict | None): Mongo query the requests must match.
+        sort (str): Key of release_request_sort_fields to order by, ties are broken by id.
+        ascending (bool): Sort order.
+        limit (int): Page size.
+        cursor (str | None): Cursor returned with the previous page.
+        summary (bool): Return only the fields of release_request_summary_projection.
+
+    Returns:
+        tuple[list[dict], str | None]: Requests of the page and the cursor of the next one,
+            None on the last page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    sort_field = release_request_sort_fields[sort]
+    direction = 1 if ascending else -1
+    query = dict(filters or {})
+
+    if cursor is not None:
+        try:
+            value, last_id = decode_release_requests_cursor(cursor)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        operator = "$gt" if ascending else "$lt"
+        if sort_field == "_id":
+            after = {"_id": {operator: last_id}}
+        else:
+            after = {"$or": [{sort_field: {operator: value}}, {sort_field: value, "_id": {operator: last_id}}]}
+        query = {"$and": [query, after]} if query else after
+
+    projection = release_request_summary_projection if summary else None
+    order = [(sort_field, direction)] if sort_field == "_id" else [(sort_field, direction), ("_id", direction)]
+    result = await release_requests.find(query, projection).sort(order).limit(limit + 1).to_list(None)
+
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        last = result[-1]
+        next_cursor = encode_release_requests_cursor(None if sort_field == "_id" else last.get(sort_field), last["_id"])
     requests = change_mongo_id_to_str(result)
-    return requests
+    return requests, next_cursor
 
 
 async def get_release_request_by_id(id: str) -> dict | None:
@@ -44,27 +134,52 @@ async def get_release_request_by_id(id: str) -> dict | None:
     return request[0]
 
 
+release_request_updatable_fields = ('date', 'imprint', 'data', 'in_delivery_sheet', 'in_docs_sheet', 'cloud_link')
+# fields the delivered files and sheet rows are made from
+release_request_delivery_fields = ('date', 'imprint', 'data', 'cloud_link')
+
+
 async def update_release_request(id: str, data: dict) -> dict | None:
-    request = await get_release_request_by_id(id)
-    if request is None:
+    """
+    Set the given fields of a release request in one atomic update.
+
+    Args:
+        id (str): Id of the release request.
+        data (dict): New values, keys outside release_request_updatable_fields are ignored.
+            Changing a delivered field drops the checkpoints of an earlier delivery attempt.
+
+    Returns:
+        dict | None: The release request after the update, None if it does not exist.
+    """
+    changes = {key: value for key, value in data.items() if key in release_request_updatable_fields}
+    if not changes:
+        return await get_release_request_by_id(id)
+
+    update = {"$set": changes}
+    if any(key in release_request_delivery_fields for key in changes):
+        update["$unset"] = {"delivery_checkpoints": ""}
+
+    result = await release_requests.find_one_and_update(
+        {"_id": ObjectId(id)},
+        update,
+        return_document=ReturnDocument.AFTER,
+    )
+    if result is None:
         return None
-    
-    new_date: str = data.get('date', request.get('date'))
-    new_imprint: str = data.get('imprint', request.get('imprint'))
-    new_data: dict = data.get('data', request.get('data'))
-    in_delivery_sheet: bool = data.get('in_delivery_sheet', request.get('in_delivery_sheet'))
-    in_docs_sheet: bool = data.get('in_docs_sheet', request.get('in_docs_sheet'))
-    new_cloud_link: str = data.get('cloud_link', request.get('cloud_link'))
-
-    request['date'] = new_date
-    request['imprint'] = new_imprint
-    request['data'] = new_data
-    request['in_delivery_sheet'] = in_delivery_sheet
-    request['in_docs_sheet'] = in_docs_sheet
-    request['cloud_link'] = new_cloud_link
-    del request['id']
-
-    await release_requests.replace_one({"_id": ObjectId(id)}, request)
-    updated_release_request = await get_release_request_by_id(id)
-
-    return updated_release_request
+    request = change_mongo_id_to_str([result])
+    return request[0]
+
+
+async def set_delivery_checkpoint(id: str, key: str, step: str, result):
+    await release_requests.update_one(
+        {"_id": ObjectId(id)},
+        {"$set": {f"delivery_checkpoints.{key}": {'step': step, 'result': result, 'at': datetime.utcnow()}}}
+    )
+
+
+async def delete_delivery_checkpoint(id: str, key: str):
+    await release_requests.update_one({"_id": ObjectId(id)}, {"$unset": {f"delivery_checkpoints.{key}": ""}})
+
+
+async def clear_delivery_checkpoints(id: str):
+    await release_requests.update_one({"_id": ObjectId(id)}, {"$unset": {"delivery_checkpoints": ""}})
@@ -0,0 +1,64 @@
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from .client import db
+
+pending_sheet_rows = db['pending_sheet_rows']
+
+indexes = {
+    'pending_sheet_rows': [
+        IndexModel([('worksheet', ASCENDING), ('_id', ASCENDING)], name='worksheet_id'),
+    ],
+}
+
+
+async def add_pending_sheet_rows(worksheet: str, rows: list[list], release_id: str | None = None, flag: str | None = None) -> str:
+    result = await pending_sheet_rows.insert_one({
+        'worksheet': worksheet,
+        'rows': rows,
+        'release_id': release_id,
+        'flag': flag,
+        'created_at': datetime.utcnow(),
+        'written': False,
+        'attempts': 0,
+    })
+    return str(result.inserted_id)
+
+
+async def get_pending_sheet_rows(worksheet: str) -> list[dict]:
+    result = await pending_sheet_rows.find({"worksheet": worksheet, "failed": {"$ne": True}}).sort("_id", 1).to_list(None)
+    return result
+
+
+async def count_pending_sheet_rows() -> dict[str, int]:
+    result = await pending_sheet_rows.aggregate([
+        {"$match": {"failed": {"$ne": True}}},
+        {"$group": {"_id": "$worksheet", "rows": {"$sum": {"$size": "$rows"}}}}
+    ]).to_list(None)
+    return {item['_id']: item['rows'] for item in result}
+
+
+async def delete_pending_sheet_rows(ids: list):
+    await pending_sheet_rows.delete_many({"_id": {"$in": ids}})
+
+
+async def mark_sheet_rows_written(ids: list):
+    await pending_sheet_rows.update_many({"_id": {"$in": ids}}, {"$set": {"written": True}})
+
+
+async def record_sheet_rows_failure(id, error: str, max_attempts: int) -> bool:
+    """
+    Count a rejected write of the rows, parking them once max_attempts is reached.
+    Parked rows are kept for inspection but no longer flushed.
+
+    Returns:
+        bool: True if the rows were parked.
+    """
+    result = await pending_sheet_rows.find_one_and_update(
+        {"_id": id},
+        {"$inc": {"attempts": 1}, "$set": {"error": error}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if result is None or result['attempts'] < max_attempts:
+        return False
+    await pending_sheet_rows.update_one({"_id": id}, {"$set": {"failed": True}})
+    return True
@@ -1,5 +1,7 @@
 from unittest import result
 
+from pymongo import ReturnDocument
+
 from ..utils.password import hash_password
 from .client import db
 from .utils import change_mongo_id_to_str
@@ -7,32 +9,38 @@ from .user_data import initialize_user_data
 
 users = db['users']
 
+# users are looked up by their _id, the username
+indexes = {
+    'users': [],
+}
+
 async def add_user(user: dict) -> str:
     result = await users.insert_one(user)
     username = str(result.inserted_id)
     await initialize_user_data(username=username)
     return str(result.inserted_id)
 
-async def verify_user(username: str):
-    user = await get_user_by_username(username=username)
-    user['is_verified'] = True
-    user['_id'] = username
-    del user['username']
-    result = await users.replace_one({"_id": username}, user)
-    return str(result.upserted_id)
-
-async def get_user_by_username(username: str) -> dict | None:
-
-    result = await users.find_one({"_id": username})
+def _user_from_document(result: dict | None) -> dict | None:
     if result is None:
         return None
-    
     user = dict(result)
     user['username'] = str(user["_id"])
     del user["_id"]
-    
     return user
 
+async def verify_user(username: str) -> dict | None:
+    result = await users.find_one_and_update(
+        {"_id": username},
+        {"$set": {"is_verified": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return _user_from_document(result)
+
+async def get_user_by_username(username: str) -> dict | None:
+
+    result = await users.find_one({"_id": username})
+    return _user_from_document(result)
+
 async def get_all() -> list[dict]:
 
     result = users.find()
@@ -49,25 +57,20 @@ async def delete_user(username: str):
     return result.deleted_count
 
 
-async def change_link_upload_permission(username: str):
-    user = await get_user_by_username(username=username)
-    if user is None:
-        return
-    print('user before', user)
-    user['link_upload'] = not user['link_upload']
-    user['_id'] = username
-    del user['username']
-    print('user after', user)
-    result = await users.replace_one({"_id": username}, user)
-    return str(result.upserted_id)
+async def change_link_upload_permission(username: str) -> dict | None:
+    # the toggle runs inside the update, so two admins clicking at once cannot cancel each other out
+    result = await users.find_one_and_update(
+        {"_id": username},
+        [{"$set": {"link_upload": {"$not": ["$link_upload"]}}}],
+        return_document=ReturnDocument.AFTER,
+    )
+    return _user_from_document(result)
 
 
-async def change_password(username: str, password: str):
-    user = await get_user_by_username(username=username)
-    if user is None:
-        return None
-    user['password_hash'] = hash_password(password)
-    user['_id'] = username
-    del user['username']
-    result = await users.replace_one({"_id": username}, user)
-    return str(result.upserted_id)
+async def change_password(username: str, password: str) -> dict | None:
+    result = await users.find_one_and_update(
+        {"_id": username},
+        {"$set": {"password_hash": hash_password(password)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return _user_from_document(result)
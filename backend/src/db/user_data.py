@@ -1,7 +1,17 @@
+import hashlib
+import json
+from datetime import datetime
 from pprint import pprint
 from .client import db
 from ..schemas.user_data import initial_user_data
 user_data = db['user_data']
+user_data_versions = db['user_data_versions']
+
+# versions are looked up by their _id, the content hash
+indexes = {
+    'user_data': [],
+    'user_data_versions': [],
+}
 
 
 async def initialize_user_data(username: str):
@@ -27,3 +37,32 @@ async def get_user_data(username: str) -> dict | None:
     del user_data_dict["_id"]
     return user_data_dict
 
+
+
+def hash_user_data(data: dict) -> str:
+    # keys are sorted, so equal user data always hashes the same whatever the field order
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def save_user_data_version(data: dict) -> str:
+    """
+    Store an immutable copy of user data under its content hash, once per distinct content.
+
+    Returns:
+        str: The content hash, the id of the version.
+    """
+    version = hash_user_data(data)
+    await user_data_versions.update_one(
+        {"_id": version},
+        {"$setOnInsert": {"data": data, "created_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    return version
+
+
+async def get_user_data_version(version: str) -> dict | None:
+    result = await user_data_versions.find_one({"_id": version})
+    if result is None:
+        return None
+    return result['data']
@@ -0,0 +1,36 @@
+import re
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, IndexModel
+from .client import db
+
+yadisk_cache = db['yadisk_cache']
+
+indexes = {
+    'yadisk_cache': [
+        # Mongo removes expired entries itself
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+}
+
+
+async def get_yadisk_cache_entry(path: str) -> dict | None:
+    result = await yadisk_cache.find_one({"_id": path, "expires_at": {"$gt": datetime.utcnow()}})
+    return result
+
+
+async def set_yadisk_cache_entry(path: str, data: dict, ttl: float):
+    data['expires_at'] = datetime.utcnow() + timedelta(seconds=ttl)
+    await yadisk_cache.update_one({"_id": path}, {"$set": data}, upsert=True)
+
+
+async def delete_yadisk_cache_entries(path: str, parents: list[str] | None = None):
+    """
+    Delete the entries of a path and of everything under it, the content entries pointing there,
+    and the entries of the given parent paths.
+    """
+    pattern = f"^{re.escape(path)}(/|$)"
+    await yadisk_cache.delete_many({"$or": [
+        {"_id": {"$regex": pattern}},
+        {"path": {"$regex": pattern}},
+        {"_id": {"$in": parents or []}},
+    ]})
@@ -1,54 +1,161 @@
-from PIL import Image
+import asyncio
+import os
 from datetime import datetime
-import shutil
 from typing import Literal
-from fastapi import APIRouter, HTTPException, Response, UploadFile
-from fastapi.responses import FileResponse
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
 
-from ..db.file import add_file, get_file_by_id
-from ..config import download_dir
+from ..db.file import add_file, delete_file, get_file_by_id, update_file
+from ..config import upload_size_limits, upload_size_limit_default
+from ..utils.downloads import DownloadTarget, download_targets, file_response, immutable_cache_control, make_etag, revalidate_cache_control
+from ..utils.file_store import file_path, store_file
+from ..utils.images import convert_image_to_jpeg, derivative_path, derivative_sizes, make_image_derivatives
+from ..utils.storage import StorageQuotaExceeded, storage_manager
+from ..utils.upload_stream import MultipartFileStream, UploadTooLarge
+from ..utils.upload_pipeline import PreviewOffsetError, get_track_preview, process_upload, upload_stages
+from ..utils.waveform import compute_peaks
+from ..utils.wavFile import parse_duration
+from .utils import convert_keys_to_camel_case
 
 
 file_router = APIRouter(prefix="/file", tags=["file"])
 
 
+async def iterate_bytes(data: bytes):
+    yield data
+
+
 @file_router.post('/')
-async def upload(file: UploadFile):
-    upload_datetime = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-    file_extension = file.filename.split(".")[-1]
-    file_id = await add_file({'upload_datetime': upload_datetime, 'name': file.filename, 'extension': file_extension})
-    
+async def upload(request: Request, background_tasks: BackgroundTasks):
+    try:
+        upload_stream = MultipartFileStream(request)
+        filename = await upload_stream.open()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        download_dir.mkdir(parents=True, exist_ok=True)
+        storage_manager.check_quota(int(request.headers.get('content-length', 0)))
+    except StorageQuotaExceeded as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+    upload_datetime = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    # stored and processed under the lowercase extension, so IMG_0001.JPG is found as <id>.jpg
+    file_extension = filename.split(".")[-1].lower()
+    file_id = await add_file({'upload_datetime': upload_datetime, 'name': filename, 'extension': file_extension})
+    max_size = upload_size_limits.get(file_extension, upload_size_limit_default)
 
+    try:
         # Check if the file is an image
-        if file_extension.lower() in ['jpeg', 'png', 'bmp', 'tiff', 'gif']:
+        if file_extension in ['jpeg', 'png', 'bmp', 'tiff', 'gif']:
             # Convert image to jpg
-            image = Image.open(file.file)
-            image = image.convert("RGB")
-            filename = f'{file_id}.jpg'  # Change the file extension to jpg
-            with open(download_dir/filename, 'wb') as buffer:
-                image.save(buffer, format="JPEG")
+            image_data = b''.join([chunk async for chunk in upload_stream.chunks(max_size)])
+            jpeg_data = await asyncio.to_thread(convert_image_to_jpeg, image_data)
+            stored_file = await store_file(iterate_bytes(jpeg_data), file_id, 'jpg')
+            # the file is served as jpg from now on
+            await update_file(file_id, {'extension': 'jpg'})
         else:
             # Save the file as it is
-            filename = f'{file_id}.{file_extension}'
-            with open(download_dir/filename, 'wb') as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            stored_file = await store_file(upload_stream.chunks(max_size), file_id, file_extension)
+
+        storage_manager.add_usage(stored_file['size'])
+        if file_extension in upload_stages:
+            background_tasks.add_task(process_upload, file_id, file_extension)
+
+        return {"id": file_id, "sha256": stored_file['sha256']}
+
+    except UploadTooLarge as e:
+        await delete_file(file_id)
+        raise HTTPException(status_code=413, detail=str(e))
 
-        return {"id": file_id}
-    
     except:
+        await delete_file(file_id)
         raise HTTPException(status_code=400, detail="Something went wrong")
 
 
+@file_router.get('/storage')
+async def get_storage_metrics():
+    return convert_keys_to_camel_case(storage_manager.metrics())
+
+
+@file_router.get('/storage/gc-report')
+async def get_storage_gc_report():
+    # what the next sweep would delete, nothing is deleted
+    return convert_keys_to_camel_case(await storage_manager.collect_garbage(dry_run=True))
+
+
+@file_router.get('/peaks')
+async def get_peaks(id: str):
+    file = await get_file_by_id(id)
+    if file is None or file.get('extension') != 'wav':
+        raise HTTPException(status_code=404, detail="WAV file not found")
+
+    waveform = file.get('waveform')
+    if waveform is None:
+        # uploaded before peaks were computed at upload, or the upload stage has not finished yet
+        wav_path = file_path(id, 'wav')
+        if not wav_path.exists():
+            raise HTTPException(status_code=404, detail="WAV file not found")
+        waveform = await asyncio.to_thread(compute_peaks, wav_path)
+        await update_file(id, {'waveform': waveform})
+
+    waveform = {**waveform, 'peaks': np.frombuffer(waveform['peaks'], dtype=np.int8).tolist()}
+    return convert_keys_to_camel_case(waveform)
+
+
+@file_router.get('/preview')
+async def get_preview(request: Request, id: str, start: str | None = None):
+    try:
+        start_seconds = parse_duration(start) if start is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Start must look like 1:30")
+
+    try:
+        clip_path = await get_track_preview(id, start_seconds)
+    except PreviewOffsetError:
+        raise HTTPException(status_code=400, detail="Only the preview starting at the release preview timestamp is available")
+    if clip_path is None:
+        raise HTTPException(status_code=404, detail="Preview not available")
+    stat_result = await asyncio.to_thread(os.stat, clip_path)
+    # without an offset the URL keeps serving whatever clip the release timestamp selects,
+    # so the client has to revalidate; with one the offset has been checked against the clip
+    cache_control = immutable_cache_control if start_seconds is not None else revalidate_cache_control
+    return file_response(request, DownloadTarget(clip_path, clip_path.name, None), stat_result, cache_control)
+
+
 @file_router.get('/')
-async def download(id: str):
+async def download(request: Request, id: str, size: int | None = None):
+    target = download_targets.get((id, size))
+    if target is None:
+        target = await get_download_target(id, size)
+        download_targets[(id, size)] = target
+
+    try:
+        stat_result = await asyncio.to_thread(os.stat, target.path)
+    except FileNotFoundError:
+        # the local copy was released after delivery
+        download_targets.pop((id, size), None)
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_response(request, target, stat_result)
+
+
+async def get_download_target(id: str, size: int | None) -> DownloadTarget:
     file = await get_file_by_id(id)
     if file is None:
         raise HTTPException(status_code=404, detail="File not found")
     file_name = f'{file.get("id")}.{file.get("extension")}'
-    file_path = download_dir/file_name
-    print(file_path)
-    if not file_path.exists():
+    local_path = file_path(id, file.get("extension"))
+    if not local_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, headers={"Content-Disposition": f"attachment; filename={file_name}"})
+
+    if size is None:
+        return DownloadTarget(local_path, file_name, make_etag(file.get('sha256'), local_path.stat()))
+
+    if file.get("extension") != 'jpg' or size not in derivative_sizes:
+        raise HTTPException(status_code=400, detail=f"Size must be one of {list(derivative_sizes)} for images")
+    file_name = f'{file.get("id")}_{size}.jpg'
+    local_path = derivative_path(id, size)
+    if not local_path.exists():
+        # uploaded before derivatives existed, or the upload stage has not finished yet
+        image = await asyncio.to_thread(make_image_derivatives, id)
+        await update_file(id, {'image': image})
+    return DownloadTarget(local_path, file_name, None)
@@ -1,34 +1,39 @@
-import datetime
 import enum
 import pprint
-from typing import Any, Union
-from fastapi import APIRouter, HTTPException, Response
+import re
+from typing import Any, Literal, Optional, Union
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Response
 from loguru import logger
 
 from ..schemas import ReleaseFileUploadRequest, ReleaseCloudUploadRequest, ReleaseFileRequestOut, ReleaseCloudRequestOut, ReleaseRequestUpdate
 
-from ..db.release_requests import add_release_request, get_processed_request, get_processed_requests, get_release_requests, get_release_request_by_id, update_release_request, add_processed_request
+from ..db.release_requests import add_release_request, get_latest_processed_request, get_processed_request, get_processed_requests, get_release_requests, get_release_request_by_id, update_release_request
+from ..db.delivery_jobs import add_delivery_job, get_delivery_job_by_id
 from ..db.user import get_user_by_username
-from ..db.user_data import get_user_data
+from ..db.user_data import get_user_data, get_user_data_version, hash_user_data, save_user_data_version
 
 from .utils import convert_keys_to_camel_case
-from ..utils.wavFile import get_wav_duration, convert_wav_to_mp3
-from ..utils.google_sheets import write_rows_to_google_sheet
-from ..utils.yandex_disk import get_yadisk_api
-from ..config import download_dir
+from ..utils.wavFile import get_wav_duration
+from ..utils.delivery import delivery_queue
+from ..utils.sheet_buffer import sheet_buffer
+from ..utils.upload_pipeline import make_release_previews
+from ..utils.yandex_disk import async_yadisk as yadisk
+from ..utils.file_store import file_path
 
 release_router = APIRouter(prefix='/release', tags=['release'])
-yadisk = get_yadisk_api()
 
 
 @release_router.post('/request')
-async def upload(request: Union[ReleaseCloudUploadRequest, ReleaseFileUploadRequest]):
+async def upload(request: Union[ReleaseCloudUploadRequest, ReleaseFileUploadRequest], background_tasks: BackgroundTasks):
     user = await get_user_by_username(request.username)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     release_request = request.model_dump()
-    release_request['user_data'] = await get_user_data(username=request.username)
+    user_data = await get_user_data(username=request.username)
+    # the request keeps only a reference to an immutable copy of the user data it was made with
+    release_request['user_data_version'] = await save_user_data_version(user_data) if user_data is not None else None
     release_id = await add_release_request(release_request=release_request)
+    background_tasks.add_task(make_release_previews, release_request['data'])
     return {"id": str(release_id)}
 
 
@@ -41,18 +46,58 @@ async def get_request(id: str):
 
 
 @release_router.put('/request')
-async def update_request(id: str, request: ReleaseRequestUpdate):
+async def update_request(id: str, request: ReleaseRequestUpdate, background_tasks: BackgroundTasks):
     pprint.pprint(request.model_dump())
     request = await update_release_request(id, request.model_dump())
     if request is None:
         raise HTTPException(status_code=404, detail="Request not found")
+    background_tasks.add_task(make_release_previews, request['data'])
     return convert_keys_to_camel_case(request)
 
 
 @release_router.get('/requests')
-async def get_requests():
-    requests = await get_release_requests()
-    return convert_keys_to_camel_case(requests)
+async def get_requests(
+    status: Optional[Literal['pending', 'accepted', 'error']] = None,
+    type: Optional[Literal['new-music', 'back-catalog', 'clip']] = None,
+    username: Optional[str] = None,
+    in_delivery_sheet: Optional[bool] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Literal['created', 'date'] = 'created',
+    order: Literal['asc', 'desc'] = 'desc',
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    view: Literal['summary', 'full'] = 'summary',
+):
+    filters = {}
+    if status is not None:
+        filters['status'] = status
+    if type is not None:
+        filters['type'] = type
+    if username is not None:
+        filters['username'] = username
+    if in_delivery_sheet is not None:
+        filters['in_delivery_sheet'] = in_delivery_sheet
+    if date_from is not None or date_to is not None:
+        # release dates are stored as ISO strings, so they compare as text
+        filters['date'] = {}
+        if date_from is not None:
+            filters['date']['$gte'] = date_from
+        if date_to is not None:
+            filters['date']['$lte'] = date_to
+    if search:
+        # what the admin search box matches: performers, title, imprint and release date
+        pattern = {'$regex': re.escape(search), '$options': 'i'}
+        filters['$or'] = [{field: pattern} for field in ('data.performers', 'data.title', 'imprint', 'date')]
+
+    try:
+        requests, next_cursor = await get_release_requests(
+            filters, sort=sort, ascending=order == 'asc', limit=limit, cursor=cursor, summary=view == 'summary'
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": convert_keys_to_camel_case(requests), "nextCursor": next_cursor}
 
 
 @release_router.get('/processed-requests')
@@ -67,182 +112,55 @@ async def upload_request(id: str):
     print(request)
 
 
-@release_router.post('/add-to-delivery')
+@release_router.post('/add-to-delivery', status_code=202)
 async def add_to_delivery(id: str):
 
     request = await get_release_request_by_id(id)
     if request is None:
         raise HTTPException(status_code=404, detail="Request not found")
 
-    release_cloud_link: str = request.get('cloud_link')
-    request_data = request.get('data')
     release_type = request.get('type')
-    release_title = request_data.get('title')
-    release_imprint = request.get('imprint')
-    release_date = request.get('date')
-    release_performers = request_data.get('performers')
-    release_version = request_data.get('version')
-    release_upc = request_data.get('upc', '')
     logger.info(f'release_type: {release_type}')
 
-    if release_date is None or release_imprint is None:
+    if request.get('date') is None or request.get('imprint') is None:
         raise HTTPException(status_code=400, detail="Delivery date and imprint are required")
 
-    data_rows = []
-    processed_request = {}
-
     if release_type == 'clip':
         logger.debug('Not implemented: clip')
         return
-    
-    elif release_type == 'new-music' or release_type == 'back-catalog':   
-        tracks: list = request_data.get('tracks')
 
-        username = request.get('username')
-        user = await get_user_by_username(username)
-        user_nickname = user.get('nickname')
+    elif release_type == 'new-music' or release_type == 'back-catalog':
+        job_id, created = await add_delivery_job(release_id=id)
+        if created:
+            await delivery_queue.enqueue(job_id)
+        return {"id": job_id}
 
-        if len(tracks) ==  1:
-            release_name_type = 'Single'
-        elif 1 <= len(tracks) <= 6:
-            release_name_type = 'EP'
-        else:
-            release_name_type = 'Full Length'
+    else:
+        raise HTTPException(status_code=404, detail="Release type")
 
-        # cloud upload
-        if release_cloud_link == '' or release_cloud_link is None:
 
-            version_string = f' ({release_version})' if release_version else ''
-            source_folder_public_name = f'{release_performers} - {release_title}{version_string}'
-            
-            artist_path = f'requests-media/{user_nickname}'
-            source_path = f'{artist_path}/{source_folder_public_name}'
-            yadisk.create_service_dir(artist_path)
-            yadisk.create_service_dir(source_path)
-            source_public_link = yadisk.publish(source_path)
-
-            cover_file_id = request_data['cover_file_id']
-            yadisk.upload_file(download_dir / f'{cover_file_id}.jpg', f'{source_path}/{release_performers} - {release_title}.jpg')
-            cover_public_link = yadisk.publish(f'{source_path}/{release_performers} - {release_title}.jpg')
-
-            if release_name_type != 'Single':
-                yadisk_media_dirs = {
-                    "wav": f'{source_path}/wav',
-                    "mp3": f'{source_path}/mp3',
-                    "lyrics": f'{source_path}/lyrics',
-                }
-                yadisk.create_service_dir(yadisk_media_dirs['wav'])
-                yadisk.create_service_dir(yadisk_media_dirs['mp3'])
-                yadisk.create_service_dir(yadisk_media_dirs['lyrics'])
-            else:
-                yadisk_media_dirs = {
-                    "wav": source_path,
-                    "mp3": source_path,
-                    "lyrics": source_path,
-                }
-        else:
-            source_public_link = release_cloud_link
-
-        processed_tracks = []
-        for index, track in enumerate(tracks):
-            processed_track = track
-
-            data_row = ["" for _ in range(44)]
-
-            track_version_alias = f" ({track.get('version')})" if track.get('version') else ""
-            track_title = f"{index+1:02}. {track.get('performers')} - {track.get('title')}{track_version_alias}"
-
-            # ! cloud upload
-            if release_cloud_link == '' or release_cloud_link is None:
-                wav_file_id = track.get('wav_file_id')
-                wav_file_public_path =  f"{yadisk_media_dirs['wav']}/{track_title}.wav"
-                wav_file_local_path = download_dir/f'{wav_file_id}.wav'
-                yadisk.upload_file(wav_file_local_path, wav_file_public_path)
-                
-                processed_track['wavLink'] = yadisk.publish(wav_file_public_path)
-                del processed_track['wav_file_id']
-
-                mp3_file_public_path = f"{yadisk_media_dirs['mp3']}/{track_title}.mp3"
-                mp3_file_local_path = convert_wav_to_mp3(wav_file_id)
-                yadisk.upload_file(mp3_file_local_path, mp3_file_public_path)
-
-                text_file_id = track.get('text_file_id')
-                del processed_track['text_file_id']
-                processed_track['textLink'] = ''
-
-                if text_file_id is not None:
-                    text_file_public_path = f"{yadisk_media_dirs['lyrics']}/{track_title}.docx"
-                    text_file_local_path = download_dir/f'{text_file_id}.docx'
-                    yadisk.upload_file(text_file_local_path, text_file_public_path)
-                    processed_track['textLink'] = yadisk.publish(text_file_public_path)
-                    if text_file_local_path:
-                        text_file_local_path.unlink(missing_ok=True)
-            
-                if release_type != 'Single':
-                    wav_public_link = yadisk.publish(yadisk_media_dirs['wav'])
-                    mp3_public_link = yadisk.publish(yadisk_media_dirs['mp3'])
-                else:
-                    wav_public_link = yadisk.publish(wav_file_public_path)
-                    mp3_public_link = yadisk.publish(mp3_file_public_path)
-                
-            splitted_date = request.get('date').split('-')
-            actual_date = f'{splitted_date[2]}.{splitted_date[1]}.{splitted_date[0]}'
-
-            # ! cloud upload
-            if release_cloud_link == '' or release_cloud_link is None:
-                data_row[7] = get_wav_duration(wav_file_id)
-                data_row[19] = wav_public_link
-                data_row[20] = cover_public_link
-                data_row[21] = mp3_public_link
-                if wav_file_local_path:
-                    wav_file_local_path.unlink(missing_ok=True)
-                if mp3_file_local_path:
-                    mp3_file_local_path.unlink(missing_ok=True)
-
-            data_row[0] = release_performers
-            data_row[1] = track.get('performers')
-            data_row[2] = track.get('title')
-            data_row[3] = track.get('version')
-            data_row[4] = index + 1
-            data_row[5] = request_data.get('title')
-            data_row[6] = release_name_type
-            data_row[8] = actual_date
-            data_row[10] = track.get('music_authors_names')
-            data_row[11] = track.get('lyricists_names', '')
-            data_row[12] = 'Yes' if track.get('explicit') else 'No'
-            data_row[13] = track.get('isrc', '')
-            data_row[14] = release_upc
-            data_row[15] = request_data.get('genre')
-            data_row[16] = request_data.get('genre')
-            data_row[17] = request.get('imprint')
-            data_row[22] = source_public_link
-            data_row[27] = track.get('preview', '0:00')
-            data_row[39] = '0' if track.get('is_cover') else '100'
-            
-            data_rows.append(data_row)
-            
-            processed_tracks.append(processed_track)
+@release_router.get('/delivery-jobs/{id}')
+async def get_delivery_job(id: str):
+    job = await get_delivery_job_by_id(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return convert_keys_to_camel_case(job)
 
-        processed_request = request
-        processed_request['data']['tracks'] = processed_tracks
 
-        # ! cloud upload
-        if release_cloud_link == '' or release_cloud_link is None:
-            processed_request['data']['coverLink'] = cover_public_link
-            del processed_request['data']['cover_file_id']
-        
-        del processed_request['id']
-        processed_request['_id'] = id
+def get_user_data_version_of(request: dict) -> str | None:
+    if request.get('user_data_version') is not None:
+        return request['user_data_version']
+    # requests made before user data was versioned embed the whole copy
+    if request.get('user_data') is not None:
+        return hash_user_data(request['user_data'])
+    return None
 
-        write_rows_to_google_sheet("Test", data_rows)
-    
-        await add_processed_request(processed_request)
-        await update_release_request(id, {'in_delivery_sheet': True})
 
-        return Response(status_code=200)
+async def get_release_user_data(request: dict) -> dict | None:
+    if request.get('user_data_version') is not None:
+        return await get_user_data_version(request['user_data_version'])
+    return request.get('user_data')
 
-    else:
-        raise HTTPException(status_code=404, detail="Release type") 
 
 @release_router.post('/add-to-docs')
 async def add_to_docs(id: str):
@@ -252,18 +170,12 @@ async def add_to_docs(id: str):
         raise HTTPException(status_code=404, detail="Request not found")
 
     current_user_data = await get_user_data(username=request.get('username'))
+    current_user_data_version = hash_user_data(current_user_data) if current_user_data is not None else None
 
-    user_releases_dicts = await get_processed_requests(username=request.get('username'))
-    def parse_date(date_string):
-    # Example format: "YYYY-MM-DD"
-        return datetime.strptime(date_string, "%Y-%m-%d")
-
-    # Assuming 'user_releases' is a list of dictionaries and each dictionary has a 'date' key.
-    # We'll use the parse_date function to convert the date string to a datetime object for comparison.
-    latest_release = max(user_releases_dicts, key=lambda x: parse_date(x['date'])) if user_releases_dicts else None
-    latest_user_data = latest_release.get('user_data') if latest_release else None
+    latest_release = await get_latest_processed_request(username=request.get('username'))
+    latest_user_data_version = get_user_data_version_of(latest_release) if latest_release else None
 
-    if current_user_data == latest_user_data:
+    if current_user_data_version == latest_user_data_version:
         user_data_changed = False
     else:
         user_data_changed = True
@@ -277,7 +189,7 @@ async def add_to_docs(id: str):
     def error_response(error: str):
         raise HTTPException(status_code=400, detail=error)
     
-    yadisk.create_service_dir('closed_docs')
+    await yadisk.create_service_dir('closed_docs')
 
     data_row: list[str] = ["" for _ in range(350)]
 
@@ -287,7 +199,9 @@ async def add_to_docs(id: str):
     release_date = request.get('date')
     release_performers = request_data.get('performers')
 
-    release_author = request.get('user_data')
+    release_author = await get_release_user_data(request)
+    if release_author is None:
+        error_response("Данные пользователя не найдены")
     release_author_passport_type = release_author.get('current_passport')
     release_author_legal_entity_type = release_author.get('current_legal_entity')
 
@@ -421,6 +335,7 @@ async def add_to_docs(id: str):
         tracks: list = request_data.get('tracks')
         tracks_enumed_titles = []
         tracks_enumed_durations = []
+        tracks_durations = []
         tracks_enumed_music_authors = []
         tracks_enumed_lyricists = []
         tracks_enumed_phonogram_producers = []
@@ -440,11 +355,13 @@ async def add_to_docs(id: str):
 
             wav_file_id = track.get('wav_file_id')
             if wav_file_id != '':
-                track_duration = get_wav_duration(wav_file_id)
+                track_duration = await get_wav_duration(wav_file_id)
+                tracks_durations.append(track_duration)
                 if track_duration is None:
                     track_duration = 0
                 tracks_enumed_durations.append(f"{i + 1}. {track_duration}")
             else:
+                tracks_durations.append(None)
                 tracks_enumed_durations.append(f"{i + 1}. -")
             
             tracks_enumed_music_authors.append(f"{i + 1}. {', '.join(track_music_authors_names) if len(track_music_authors_names) else '-'}") 
@@ -467,7 +384,7 @@ async def add_to_docs(id: str):
                 data_row[122] = track.get('music_authors_names')
                 data_row[123] = track.get('phonogram_producers_names')
                 data_row[124] = track.get('performers_names')
-                data_row[125] = get_wav_duration(track.get('wav_file_id'))
+                data_row[125] = tracks_durations[0]
                 data_row[126] = cover_file_public_link
                 data_row[127] = release_date
 
@@ -574,13 +491,13 @@ async def add_to_docs(id: str):
     data_row[7] = release_author.get('email')
     data_row[8] = release_author.get('socials')
 
-    def add_scans_authors_sections(col_index: int, scans_ids: list[str]):
+    async def add_scans_authors_sections(col_index: int, scans_ids: list[str]):
         public_paths = []
         for scan_id in scans_ids:
-            scan_local_path = download_dir/f'{scan_id}.jpg'
+            scan_local_path = file_path(scan_id, 'jpg')
             scan_cloud_path = f'closed_docs/{scan_id}.jpg'
-            yadisk.upload_file(scan_local_path, scan_cloud_path)
-            public_path = yadisk.publish(scan_cloud_path)
+            await yadisk.upload_file(scan_local_path, scan_cloud_path)
+            public_path = await yadisk.publish(scan_cloud_path)
             public_paths.append(public_path)
         data_row[col_index] = ", ".join(public_paths) if public_paths else ""
 
@@ -643,14 +560,14 @@ async def add_to_docs(id: str):
 
     add_ru_authors_sections(160, specific_authors['music_authors']['ru'])
     add_foreign_authors_sections(193, specific_authors['music_authors']['foreign'])
-    add_scans_authors_sections(158, specific_authors['music_authors']['scans'])
+    await add_scans_authors_sections(158, specific_authors['music_authors']['scans'])
 
     add_ru_authors_sections(232, specific_authors['lyricists']['ru'])
     add_foreign_authors_sections(265, specific_authors['lyricists']['foreign'])
-    add_scans_authors_sections(230, specific_authors['lyricists']['scans'])
+    await add_scans_authors_sections(230, specific_authors['lyricists']['scans'])
 
     add_ru_authors_sections(304, specific_authors['phonogram_producers']['ru'])
     add_foreign_authors_sections(326, specific_authors['phonogram_producers']['foreign'])
-    add_scans_authors_sections(302, specific_authors['phonogram_producers']['scans'])
+    await add_scans_authors_sections(302, specific_authors['phonogram_producers']['scans'])
     
-    write_rows_to_google_sheet('Test_Docs', [data_row])
+    await sheet_buffer.add_rows('Test_Docs', [data_row], id, 'in_docs_sheet')
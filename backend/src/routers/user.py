@@ -81,7 +81,7 @@ async def delete(username: str):
 
 @user_router.put("/link-permission")
 async def change_link_permission(username: str):
-    result = await change_link_upload_permission(username)
-    if result is None:
+    user = await change_link_upload_permission(username)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return result
+    return {"link_upload": user.get("link_upload")}
@@ -0,0 +1,131 @@
+from pathlib import Path
+
+import numpy as np
+
+from .wavFile import WAVE_FORMAT_IEEE_FLOAT, iter_wav_blocks, read_wav_info
+
+silence_level = 10 ** (-60 / 20)
+dc_offset_limit = 10 ** (-40 / 20)
+silence_padding_limit = 2.0
+min_sample_rate = 44100
+# loudness windows of 400 ms advanced by 100 ms, as in EBU R128
+loudness_step = 0.1
+loudness_absolute_gate = -70.0
+loudness_relative_gate = -10.0
+
+
+def to_db(value: float) -> float | None:
+    return round(float(20 * np.log10(value)), 2) + 0.0 if value > 0 else None
+
+
+def gated_loudness(step_powers: np.ndarray) -> float | None:
+    """
+    Integrated loudness of the signal from the mean square of its 100 ms steps, gated like EBU R128.
+    The K-weighting filter is left out, so this is an estimate reading slightly low for bass-heavy tracks.
+    """
+    if len(step_powers) < 4:
+        return None
+    window_powers = np.convolve(step_powers, np.ones(4) / 4, mode='valid')
+    window_loudness = -0.691 + 10 * np.log10(np.maximum(window_powers, 1e-20))
+
+    gated = window_powers[window_loudness > loudness_absolute_gate]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + loudness_relative_gate
+    gated = window_powers[(window_loudness > loudness_absolute_gate) & (window_loudness > relative_gate)]
+    return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+
+def analyze_wav(file_path: Path, block_frames: int = 1 << 18) -> dict:
+    """
+    Measure the signal of a WAV file to catch bad masters.
+    Samples are processed block by block, so memory use does not depend on the length of the track.
+
+    Args:
+        file_path (Path): Path to the WAV file.
+        block_frames (int): Number of frames read at once.
+
+    Returns:
+        dict: peak and rms in dBFS, loudness (LUFS estimate), clipped_samples,
+            leading_silence and trailing_silence in seconds, dc_offset per channel,
+            mono_in_stereo and the list of detected issues.
+    """
+    info = read_wav_info(file_path)
+    sample_rate, channels, frames = info['sample_rate'], info['channels'], info['frames']
+    if info['audio_format'] == WAVE_FORMAT_IEEE_FLOAT:
+        clip_level = 1.0
+    else:
+        clip_level = 1 - 2 ** (1 - info['bit_depth'])
+
+    step_frames = max(int(sample_rate * loudness_step), 1)
+    # whole loudness steps per block, so no step is split between two blocks
+    block_frames = max(block_frames // step_frames, 1) * step_frames
+
+    peak = 0.0
+    sample_sum = np.zeros(channels)
+    clipped_samples = 0
+    first_sound = last_sound = None
+    max_side = 0.0
+    step_sums = []
+    step_lengths = []
+
+    position = 0
+    for block in iter_wav_blocks(file_path, info, block_frames):
+        # channel-major rows make the reductions across channels element-wise and fast
+        samples = np.ascontiguousarray(block.T)
+        magnitude = np.abs(samples)
+        frame_peaks = magnitude.max(axis=0)
+        peak = max(peak, float(frame_peaks.max()))
+        clipped_samples += int(np.count_nonzero(magnitude >= clip_level))
+        sample_sum += samples.sum(axis=1, dtype=np.float64)
+
+        starts = np.arange(0, samples.shape[1], step_frames)
+        step_sums.append(np.add.reduceat(np.square(samples).sum(axis=0), starts, dtype=np.float64))
+        step_lengths.append(np.diff(starts, append=samples.shape[1]))
+
+        sound = np.flatnonzero(frame_peaks >= silence_level)
+        if len(sound):
+            if first_sound is None:
+                first_sound = position + int(sound[0])
+            last_sound = position + int(sound[-1])
+
+        if channels == 2:
+            max_side = max(max_side, float(np.abs(samples[0] - samples[1]).max()))
+        position += samples.shape[1]
+
+    step_sums = np.concatenate(step_sums)
+    step_powers = step_sums / (np.concatenate(step_lengths) * channels)
+
+    if first_sound is None:
+        leading_silence = trailing_silence = frames / sample_rate
+    else:
+        leading_silence = first_sound / sample_rate
+        trailing_silence = (frames - last_sound - 1) / sample_rate
+    dc_offset = sample_sum / frames
+    mono_in_stereo = channels == 2 and max_side < silence_level
+
+    issues = []
+    if clipped_samples:
+        issues.append('clipping')
+    if sample_rate < min_sample_rate:
+        issues.append('low_sample_rate')
+    if first_sound is None:
+        issues.append('silent')
+    elif leading_silence > silence_padding_limit or trailing_silence > silence_padding_limit:
+        issues.append('silence_padding')
+    if np.abs(dc_offset).max() > dc_offset_limit:
+        issues.append('dc_offset')
+    if mono_in_stereo:
+        issues.append('mono_in_stereo')
+
+    return {
+        'peak': to_db(peak),
+        'rms': to_db(float(np.sqrt(step_sums.sum() / (frames * channels)))),
+        'loudness': gated_loudness(step_powers),
+        'clipped_samples': clipped_samples,
+        'leading_silence': round(leading_silence, 3),
+        'trailing_silence': round(trailing_silence, 3),
+        'dc_offset': [round(float(value), 6) for value in dc_offset],
+        'mono_in_stereo': mono_in_stereo,
+        'issues': issues,
+    }
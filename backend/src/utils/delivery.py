@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Callable
+
+from loguru import logger
+
+from ..db.delivery_jobs import add_delivery_job_step, finish_delivery_job, finish_delivery_job_step, get_delivery_job_by_id, get_unfinished_delivery_jobs, update_delivery_job
+from ..db.release_requests import add_processed_request, clear_delivery_checkpoints, delete_delivery_checkpoint, get_release_request_by_id, set_delivery_checkpoint
+from ..db.file import get_file_by_id
+from ..db.user import get_user_by_username
+from ..config import delivery_workers, delivery_track_concurrency
+from .file_store import file_path, release_local_file
+from .sheet_buffer import sheet_buffer
+from .upload_pipeline import get_track_mp3
+from .wavFile import get_wav_duration
+from .yandex_disk import async_yadisk as yadisk
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class DeliveryJob:
+
+    def __init__(self, id: str, release_id: str, checkpoints: dict | None = None):
+        """
+        Initialize a DeliveryJob object.
+
+        Args:
+            id (str): Id of the delivery job.
+            release_id (str): Id of the delivered release request.
+            checkpoints (dict | None): Steps completed by earlier attempts, by checkpoint key.
+        """
+        self.id = id
+        self.release_id = release_id
+        self.checkpoints = checkpoints or {}
+
+    @staticmethod
+    def checkpoint_key(name: str, args: tuple) -> str:
+        # string arguments are Disk paths and content hashes, so a step whose target
+        # changed is run again; step names contain track titles, which are not valid
+        # Mongo field names, hence the hash
+        parts = [name, *(arg for arg in args if isinstance(arg, str))]
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()[:16]
+
+    def is_done(self, name: str, *args) -> bool:
+        return self.checkpoint_key(name, args) in self.checkpoints
+
+    async def forget(self, name: str, *args):
+        """
+        Drop the checkpoint of a step, so a retried delivery runs it again.
+        """
+        key = self.checkpoint_key(name, args)
+        if self.checkpoints.pop(key, None) is not None:
+            await delete_delivery_checkpoint(self.release_id, key)
+
+    async def run(self, name: str, func: Callable, *args, required: bool = False, checkpoint: bool = True) -> Any:
+        """
+        Run a call as a tracked job step. Blocking functions are run in a worker thread,
+        coroutine functions are awaited directly.
+
+        Completed steps are checkpointed on the release request together with their
+        result, keyed by the step name and string arguments, and are skipped when a
+        failed delivery is retried.
+
+        Args:
+            name (str): Step name reported by the job-status endpoint.
+            func (Callable): Function to call.
+            required (bool): Fail the step if the call returns a falsy value.
+            checkpoint (bool): Record the step, its result has to be storable in Mongo.
+
+        Returns:
+            Any: Result of the call.
+        """
+        key = self.checkpoint_key(name, args)
+        if checkpoint and key in self.checkpoints:
+            await add_delivery_job_step(self.id, name, status='skipped')
+            return self.checkpoints[key].get('result')
+
+        await add_delivery_job_step(self.id, name)
+        try:
+            if asyncio.iscoroutinefunction(func):
+                result = await func(*args)
+            else:
+                result = await asyncio.to_thread(func, *args)
+            if required and not result:
+                raise DeliveryError(f'{name}: no result')
+        except asyncio.CancelledError:
+            # a sibling step failed
+            await finish_delivery_job_step(self.id, name, 'cancelled')
+            raise
+        except Exception as e:
+            await finish_delivery_job_step(self.id, name, 'failed', str(e))
+            raise
+
+        if checkpoint:
+            self.checkpoints[key] = {'step': name, 'result': result}
+            await set_delivery_checkpoint(self.release_id, key, name, result)
+        await finish_delivery_job_step(self.id, name, 'done')
+        return result
+
+
+async def publish_upload(job: DeliveryJob, name: str, path: str, upload_step: str, *upload_args) -> str:
+    """
+    Publish an uploaded file. If publishing fails, for instance because the file was
+    deleted on the Disk, the upload checkpoint is dropped so a retry uploads it again.
+    """
+    try:
+        return await job.run(name, yadisk.publish, path, required=True)
+    except DeliveryError:
+        await job.forget(upload_step, *upload_args)
+        raise
+
+
+async def get_file_sha256(file_id: str) -> str | None:
+    file = await get_file_by_id(file_id)
+    return (file or {}).get('sha256')
+
+
+async def deliver_release(job: DeliveryJob, id: str, request: dict):
+    release_cloud_link: str = request.get('cloud_link')
+    request_data = request.get('data')
+    release_type = request.get('type')
+    release_title = request_data.get('title')
+    release_performers = request_data.get('performers')
+    release_version = request_data.get('version')
+    release_upc = request_data.get('upc', '')
+    logger.info(f'release_type: {release_type}')
+
+    tracks: list = request_data.get('tracks')
+
+    username = request.get('username')
+    user = await get_user_by_username(username)
+    user_nickname = user.get('nickname')
+
+    if len(tracks) ==  1:
+        release_name_type = 'Single'
+    elif 1 <= len(tracks) <= 6:
+        release_name_type = 'EP'
+    else:
+        release_name_type = 'Full Length'
+
+    # cloud upload
+    if release_cloud_link == '' or release_cloud_link is None:
+
+        version_string = f' ({release_version})' if release_version else ''
+        source_folder_public_name = f'{release_performers} - {release_title}{version_string}'
+
+        artist_path = f'requests-media/{user_nickname}'
+        source_path = f'{artist_path}/{source_folder_public_name}'
+        # directories are known to the Yadisk cache, which forgets them once they go missing,
+        # so the steps are not checkpointed
+        await job.run('create artist dir', yadisk.create_service_dir, artist_path, checkpoint=False)
+        await job.run('create release dir', yadisk.create_service_dir, source_path, checkpoint=False)
+        source_public_link = await job.run('publish release dir', yadisk.publish, source_path, required=True)
+
+        cover_file_id = request_data['cover_file_id']
+        cover_public_path = f'{source_path}/{release_performers} - {release_title}.jpg'
+        cover_upload_args = (file_path(cover_file_id, 'jpg'), cover_public_path, await get_file_sha256(cover_file_id))
+        await job.run('upload cover', yadisk.upload_file, *cover_upload_args, required=True)
+        cover_public_link = await publish_upload(job, 'publish cover', cover_public_path, 'upload cover', *cover_upload_args)
+
+        if release_name_type != 'Single':
+            yadisk_media_dirs = {
+                "wav": f'{source_path}/wav',
+                "mp3": f'{source_path}/mp3',
+                "lyrics": f'{source_path}/lyrics',
+            }
+            for media_type, media_dir in yadisk_media_dirs.items():
+                await job.run(f'create {media_type} dir', yadisk.create_service_dir, media_dir, checkpoint=False)
+        else:
+            yadisk_media_dirs = {
+                "wav": source_path,
+                "mp3": source_path,
+                "lyrics": source_path,
+            }
+    else:
+        source_public_link = release_cloud_link
+
+    splitted_date = request.get('date').split('-')
+    actual_date = f'{splitted_date[2]}.{splitted_date[1]}.{splitted_date[0]}'
+
+    # local files are removed only once the whole delivery succeeded, so a failed delivery can be retried
+    delivered_file_ids = []
+    track_semaphore = asyncio.Semaphore(delivery_track_concurrency)
+
+    async def deliver_track(index: int, track: dict) -> tuple[list, dict]:
+        async with track_semaphore:
+            processed_track = track
+
+            data_row = ["" for _ in range(44)]
+
+            track_version_alias = f" ({track.get('version')})" if track.get('version') else ""
+            track_title = f"{index+1:02}. {track.get('performers')} - {track.get('title')}{track_version_alias}"
+
+            # ! cloud upload
+            if release_cloud_link == '' or release_cloud_link is None:
+                wav_file_id = track.get('wav_file_id')
+                wav_file_public_path =  f"{yadisk_media_dirs['wav']}/{track_title}.wav"
+                wav_file_local_path = file_path(wav_file_id, 'wav')
+                wav_file_sha256 = await get_file_sha256(wav_file_id)
+                mp3_file_public_path = f"{yadisk_media_dirs['mp3']}/{track_title}.mp3"
+                mp3_upload_step = f'{track_title}: upload mp3'
+
+                if job.is_done(mp3_upload_step, mp3_file_public_path):
+                    mp3_file_local_path = None
+                    await job.run(f'{track_title}: upload wav', yadisk.upload_file, wav_file_local_path, wav_file_public_path, wav_file_sha256, required=True)
+                else:
+                    # the MP3 is usually ready from upload time; if not, convert it while the WAV uploads
+                    async with asyncio.TaskGroup() as group:
+                        group.create_task(job.run(f'{track_title}: upload wav', yadisk.upload_file, wav_file_local_path, wav_file_public_path, wav_file_sha256, required=True))
+                        mp3_task = group.create_task(job.run(f'{track_title}: convert mp3', get_track_mp3, wav_file_id, required=True, checkpoint=False))
+                    mp3_file_local_path = mp3_task.result()
+
+                processed_track['wavLink'] = await publish_upload(
+                    job, f'{track_title}: publish wav', wav_file_public_path,
+                    f'{track_title}: upload wav', wav_file_local_path, wav_file_public_path, wav_file_sha256,
+                )
+                del processed_track['wav_file_id']
+
+                await job.run(mp3_upload_step, yadisk.upload_file, mp3_file_local_path, mp3_file_public_path, required=True)
+
+                text_file_id = track.get('text_file_id')
+                del processed_track['text_file_id']
+                processed_track['textLink'] = ''
+
+                if text_file_id is not None:
+                    text_file_public_path = f"{yadisk_media_dirs['lyrics']}/{track_title}.docx"
+                    text_file_local_path = file_path(text_file_id, 'docx')
+                    text_upload_args = (text_file_local_path, text_file_public_path, await get_file_sha256(text_file_id))
+                    await job.run(f'{track_title}: upload lyrics', yadisk.upload_file, *text_upload_args, required=True)
+                    processed_track['textLink'] = await publish_upload(job, f'{track_title}: publish lyrics', text_file_public_path, f'{track_title}: upload lyrics', *text_upload_args)
+                    delivered_file_ids.append(text_file_id)
+
+                data_row[7] = await get_wav_duration(wav_file_id)
+                data_row[20] = cover_public_link
+                delivered_file_ids.append(wav_file_id)
+
+            data_row[0] = release_performers
+            data_row[1] = track.get('performers')
+            data_row[2] = track.get('title')
+            data_row[3] = track.get('version')
+            data_row[4] = index + 1
+            data_row[5] = request_data.get('title')
+            data_row[6] = release_name_type
+            data_row[8] = actual_date
+            data_row[10] = track.get('music_authors_names')
+            data_row[11] = track.get('lyricists_names', '')
+            data_row[12] = 'Yes' if track.get('explicit') else 'No'
+            data_row[13] = track.get('isrc', '')
+            data_row[14] = release_upc
+            data_row[15] = request_data.get('genre')
+            data_row[16] = request_data.get('genre')
+            data_row[17] = request.get('imprint')
+            data_row[22] = source_public_link
+            data_row[27] = track.get('preview', '0:00')
+            data_row[39] = '0' if track.get('is_cover') else '100'
+
+            return data_row, processed_track
+
+    # a failing track cancels the other tracks before the job is marked failed;
+    # results are read in track order, so the sheet rows stay ordered
+    async with asyncio.TaskGroup() as group:
+        track_tasks = [group.create_task(deliver_track(index, track)) for index, track in enumerate(tracks)]
+    delivered_tracks = [task.result() for task in track_tasks]
+    data_rows = [data_row for data_row, _ in delivered_tracks]
+    processed_tracks = [processed_track for _, processed_track in delivered_tracks]
+
+    # ! cloud upload
+    if release_cloud_link == '' or release_cloud_link is None:
+        # the media dirs are shared by all tracks, so they are published once after the uploads
+        wav_public_link = await job.run('publish wav dir', yadisk.publish, yadisk_media_dirs['wav'])
+        mp3_public_link = await job.run('publish mp3 dir', yadisk.publish, yadisk_media_dirs['mp3'])
+        for data_row in data_rows:
+            data_row[19] = wav_public_link
+            data_row[21] = mp3_public_link
+
+    processed_request = request
+    processed_request['data']['tracks'] = processed_tracks
+
+    # ! cloud upload
+    if release_cloud_link == '' or release_cloud_link is None:
+        processed_request['data']['coverLink'] = cover_public_link
+        del processed_request['data']['cover_file_id']
+
+    del processed_request['id']
+    processed_request['_id'] = id
+
+    await add_processed_request(processed_request)
+    # in_delivery_sheet is set by the buffer once the rows are actually written
+    await job.run('queue delivery sheet rows', sheet_buffer.add_rows, "Test", data_rows, id, 'in_delivery_sheet')
+
+    for file_id in delivered_file_ids:
+        await release_local_file(file_id)
+
+
+async def run_delivery_job(job_id: str):
+    job = await get_delivery_job_by_id(job_id)
+    if job is None:
+        logger.warning(f'Delivery job {job_id} not found')
+        return
+
+    release_id = job.get('release_id')
+    await update_delivery_job(job_id, {'status': 'running', 'started_at': datetime.utcnow(), 'steps': [], 'error': None})
+    logger.info(f'Delivery job {job_id} started for release {release_id}')
+
+    try:
+        request = await get_release_request_by_id(release_id)
+        if request is None:
+            raise DeliveryError('Request not found')
+        checkpoints = request.pop('delivery_checkpoints', None)
+        await deliver_release(DeliveryJob(job_id, release_id, checkpoints), release_id, request)
+        # a completed delivery starts from scratch when it is requested again
+        await clear_delivery_checkpoints(release_id)
+    except Exception as e:
+        logger.exception(e)
+        # errors of concurrent steps arrive grouped, the job reports the first one
+        while isinstance(e, ExceptionGroup):
+            e = e.exceptions[0]
+        await finish_delivery_job(job_id, 'failed', str(e))
+        return
+
+    await finish_delivery_job(job_id, 'done')
+    logger.success(f'Delivery job {job_id} finished for release {release_id}')
+
+
+class DeliveryQueue:
+
+    def __init__(self, workers: int):
+        """
+        Initialize a DeliveryQueue object.
+
+        Args:
+            workers (int): Number of jobs executed concurrently.
+        """
+        self.workers = workers
+        self.queue: asyncio.Queue[str] | None = None
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        """
+        Start the workers and re-enqueue jobs left unfinished by the previous run.
+        """
+        self.queue = asyncio.Queue()
+        for job_id in await get_unfinished_delivery_jobs():
+            self.queue.put_nowait(job_id)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f'Delivery queue started with {self.workers} workers, {self.queue.qsize()} jobs pending')
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def enqueue(self, job_id: str):
+        await self.queue.put(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await run_delivery_job(job_id)
+            finally:
+                self.queue.task_done()
+
+
+delivery_queue = DeliveryQueue(delivery_workers)
@@ -0,0 +1,150 @@
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import anyio
+from cachetools import TTLCache
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from ..config import download_cache_size, download_cache_ttl
+
+# uploads are never rewritten under the same id, so clients may keep them forever;
+# they hold users' tracks and documents, so shared caches must not store them
+immutable_cache_control = "private, max-age=31536000, immutable"
+# for content that can change under the same URL, revalidated with the ETag on every use
+revalidate_cache_control = "private, no-cache"
+
+
+class DownloadTarget(NamedTuple):
+    path: Path
+    file_name: str
+    etag: str | None
+
+
+download_targets: TTLCache = TTLCache(maxsize=download_cache_size, ttl=download_cache_ttl)
+
+
+def make_etag(sha256: str | None, stat_result: os.stat_result) -> str:
+    if sha256 is not None:
+        return f'"{sha256}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    # strong comparison, weak validators never match
+    return etag in (tag.strip() for tag in header.split(','))
+
+
+def _not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single byte range.
+
+    Returns:
+        tuple[int, int] | None: First and last byte of the range, None if the header should be ignored.
+
+    Raises:
+        ValueError: If the range cannot be satisfied.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        # multipart ranges are not worth it for audio seeking, the full body is a valid answer
+        return None
+
+    start, sep, end = ranges.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start:
+            first, last = int(start), int(end) if end else size - 1
+        else:
+            first, last = size - int(end), size - 1
+    except ValueError:
+        return None
+
+    first = max(first, 0)
+    last = min(last, size - 1)
+    if first > last:
+        raise ValueError(f'Range {header} is not satisfiable for {size} bytes')
+    return first, last
+
+
+async def _read_range(path: Path, first: int, last: int, chunk_size: int = 1024 * 1024):
+    async with await anyio.open_file(path, 'rb') as file:
+        await file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = await file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, target: DownloadTarget, stat_result: os.stat_result, cache_control: str = immutable_cache_control) -> Response:
+    """
+    Build a cacheable response for a downloaded file, honouring conditional and range headers.
+
+    Args:
+        request (Request): The download request.
+        target (DownloadTarget): File to send.
+        stat_result (os.stat_result): Current stat of the file.
+        cache_control (str): Cache-Control header, immutable by default.
+
+    Returns:
+        Response: 304, 206, 416 or the full file.
+    """
+    etag = target.etag or make_etag(None, stat_result)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    if _not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header is not None and (if_range is None or if_range.strip() == etag):
+        size = stat_result.st_size
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            first, last = byte_range
+            headers.update({
+                "Content-Range": f"bytes {first}-{last}/{size}",
+                "Content-Length": str(last - first + 1),
+                "Content-Disposition": f"attachment; filename={target.file_name}",
+            })
+            return StreamingResponse(
+                _read_range(target.path, first, last),
+                status_code=206,
+                headers=headers,
+                media_type=mimetypes.guess_type(target.file_name)[0] or 'application/octet-stream',
+            )
+
+    headers["Content-Disposition"] = f"attachment; filename={target.file_name}"
+    return FileResponse(target.path, headers=headers, stat_result=stat_result)
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO
+
+from loguru import logger
+
+from ..db.file import add_blob_reference, mark_file_released, remove_blob_reference, update_file
+from ..config import download_dir
+
+blobs_dir = download_dir/'blobs'
+
+
+def blob_path(sha256: str) -> Path:
+    return blobs_dir/sha256[:2]/sha256
+
+
+def file_dir(file_id: str) -> Path:
+    # the last hex digits of an ObjectId come from its counter, so files spread evenly over 4096 directories
+    return download_dir/file_id[-3:]
+
+
+def file_path(file_id: str, extension: str) -> Path:
+    return file_dir(file_id)/f'{file_id}.{extension}'
+
+
+def _link(src_path: Path, dst_path: Path):
+    # link under a temporary name and rename, so the file appears atomically
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst_path.with_name(f'.{dst_path.name}.{uuid.uuid4().hex}')
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        # filesystems without hard links get a plain copy
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+def _write_chunk(buffer: BinaryIO, sha256, chunk: bytes):
+    sha256.update(chunk)
+    buffer.write(chunk)
+
+
+async def store_file(chunks: AsyncIterator[bytes], file_id: str, extension: str) -> dict:
+    """
+    Store an uploaded file once per content hash.
+
+    The content is hashed while it is written to a temporary file, so a failed
+    or aborted upload never leaves a partial file behind. New content
+    becomes a blob under blobs/<sha256[:2]>/<sha256>, content already stored is
+    dropped. The file is then exposed as <file_id>.<extension> in its file_dir through a hard
+    link to the blob, and the blob reference count goes up by one.
+
+    Args:
+        chunks (AsyncIterator[bytes]): Content of the file.
+        file_id (str): Id of the file.
+        extension (str): Extension the file is stored with.
+
+    Returns:
+        dict: sha256 and size of the content.
+    """
+    tmp_dir = blobs_dir/'tmp'
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir/uuid.uuid4().hex
+
+    sha256 = hashlib.sha256()
+    size = 0
+    started = time.perf_counter()
+    try:
+        with open(tmp_path, 'wb') as buffer:
+            async for chunk in chunks:
+                # hashing and disk writes run in a worker thread, so other requests keep being served
+                await asyncio.to_thread(_write_chunk, buffer, sha256, chunk)
+                size += len(chunk)
+
+        digest = sha256.hexdigest()
+        content_path = blob_path(digest)
+        if content_path.exists():
+            logger.info(f'File {file_id} duplicates stored content {digest}')
+        else:
+            content_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, content_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f'Stored file {file_id}: {size} bytes in {elapsed:.2f}s ({size / 2**20 / max(elapsed, 1e-6):.1f} MB/s)')
+
+    await asyncio.to_thread(_link, content_path, file_path(file_id, extension))
+    await add_blob_reference(digest, extension, size)
+    await update_file(file_id, {'sha256': digest, 'size': size})
+    return {'sha256': digest, 'size': size}
+
+
+async def release_local_file(file_id: str):
+    """
+    Remove the local copy of a file and its MP3 and drop its blob once nothing references it.
+    """
+    file = await mark_file_released(file_id)
+    if file is None:
+        return
+    file_path(file_id, file.get("extension")).unlink(missing_ok=True)
+    mp3_name = (file.get('mp3') or {}).get('name')
+    if mp3_name is not None:
+        (file_dir(file_id)/mp3_name).unlink(missing_ok=True)
+
+    sha256 = file.get('sha256')
+    if sha256 is None:
+        return
+    if await remove_blob_reference(sha256) <= 0:
+        blob_path(sha256).unlink(missing_ok=True)
@@ -1,25 +1,148 @@
+import threading
+import time
+
 import gspread
+from google.oauth2.service_account import Credentials
 from loguru import logger
 from pathlib import Path
-from loguru import logger
-from oauth2client.service_account import ServiceAccountCredentials
+
+from ..config import sheets_backend
 
 creds_file_path = Path(__file__).parent.parent/'dnk-test-402011-6436087599f1.json'
+spreadsheet_key = "1nSZgM3TksoKPJgv4b-V_VIxV-Tsfz8rUSilouzyIO1Y"
+
+
+class InMemoryWorksheet:
+    """
+    Offline stand-in for gspread.Worksheet, implementing the calls the writer uses.
+    Every call counts as one API request and can be slowed down to simulate network latency.
+    """
+
+    def __init__(self, title: str, latency: float = 0.0):
+        self.title = title
+        self.latency = latency
+        self.rows: list[list] = []
+        self.requests = 0
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def col_values(self, col: int) -> list:
+        self._request()
+        values = [row[col - 1] if len(row) >= col else "" for row in self.rows]
+        while values and values[-1] in ("", None):
+            values.pop()
+        return values
+
+    def insert_row(self, values: list, index: int = 1, value_input_option: str = "RAW"):
+        self._request()
+        while len(self.rows) < index - 1:
+            self.rows.append([])
+        self.rows.insert(index - 1, list(values))
+
+    def append_rows(self, values: list[list], value_input_option: str = "RAW", insert_data_option: str | None = None, table_range: str | None = None):
+        self._request()
+        while self.rows and not any(self.rows[-1]):
+            self.rows.pop()
+        self.rows.extend(list(row) for row in values)
+        return {"updates": {"updatedRows": len(values)}}
+
+
+class InMemorySpreadsheet:
+    """
+    Offline stand-in for gspread.Spreadsheet. Worksheets are created on first access.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.worksheets: dict[str, InMemoryWorksheet] = {}
+
+    def worksheet(self, title: str) -> InMemoryWorksheet:
+        if title not in self.worksheets:
+            self.worksheets[title] = InMemoryWorksheet(title, latency=self.latency)
+        return self.worksheets[title]
+
+
+in_memory_spreadsheet = InMemorySpreadsheet()
+
+
+class SheetsClientManager:
+    """
+    Long-lived Google Sheets client. Authorizes once and caches the spreadsheet
+    and worksheet handles, so a write costs only the write request itself.
+    The underlying session refreshes the access token only once it has expired.
+    """
+
+    scopes = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+    def __init__(self, creds_file_path: Path, spreadsheet_key: str):
+        self.creds_file_path = creds_file_path
+        self.spreadsheet_key = spreadsheet_key
+        self._lock = threading.Lock()
+        self._client: gspread.Client | None = None
+        self._spreadsheet: gspread.Spreadsheet | InMemorySpreadsheet | None = None
+        self._worksheets: dict[str, gspread.Worksheet | InMemoryWorksheet] = {}
+
+    def get_spreadsheet(self) -> gspread.Spreadsheet | InMemorySpreadsheet:
+        with self._lock:
+            if self._spreadsheet is None:
+                if sheets_backend == 'memory':
+                    self._spreadsheet = in_memory_spreadsheet
+                else:
+                    if self._client is None:
+                        creds = Credentials.from_service_account_file(self.creds_file_path, scopes=self.scopes)
+                        self._client = gspread.authorize(creds)
+                    self._spreadsheet = self._client.open_by_key(self.spreadsheet_key)
+            return self._spreadsheet
+
+    def get_worksheet(self, worksheet_name: str) -> gspread.Worksheet | InMemoryWorksheet:
+        worksheet = self._worksheets.get(worksheet_name)
+        if worksheet is None:
+            worksheet = self.get_spreadsheet().worksheet(worksheet_name)
+            self._worksheets[worksheet_name] = worksheet
+        return worksheet
+
+    def forget_worksheet(self, worksheet_name: str):
+        self._worksheets.pop(worksheet_name, None)
+
+
+sheets_client = SheetsClientManager(creds_file_path, spreadsheet_key)
+
+
+def is_rows_rejected(error: Exception) -> bool:
+    """
+    Tell whether the Sheets API refused the written rows themselves,
+    as opposed to a failure that goes away when the write is repeated.
+    """
+    return isinstance(error, gspread.exceptions.APIError) and error.response.status_code == 400
+
 
-def write_rows_to_google_sheet(worksheet_name: str, rows: list[list]):
-    
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(creds_file_path, scope)
-    
-    client = gspread.authorize(creds)
+def write_rows_to_google_sheet(worksheet_name: str, rows: list[list], spreadsheet: gspread.Spreadsheet | InMemorySpreadsheet | None = None):
+    """
+    Append rows after the last filled row of the worksheet in a single request.
 
-    sheet = client.open_by_key("1nSZgM3TksoKPJgv4b-V_VIxV-Tsfz8rUSilouzyIO1Y").worksheet(worksheet_name)
+    Args:
+        worksheet_name (str): Name of the worksheet.
+        rows (list[list]): Rows to append, in order.
+        spreadsheet: Spreadsheet to write to instead of the shared sheets_client one.
+    """
+    if not rows:
+        return
 
-    first_empty_row = len(sheet.col_values(1)) + 1
+    if spreadsheet is None:
+        sheet = sheets_client.get_worksheet(worksheet_name)
+    else:
+        sheet = spreadsheet.worksheet(worksheet_name)
 
     logger.info("Started writing data to google sheet")
-    for row in rows:
-        sheet.insert_row(row, index=first_empty_row)
-        first_empty_row += 1
+    try:
+        # the Sheets API locates the end of the table itself, so the first column is never read
+        sheet.append_rows(rows, value_input_option='RAW', insert_data_option='INSERT_ROWS', table_range='A1')
+    except gspread.exceptions.APIError:
+        # the worksheet may have been renamed or deleted, look it up again next time
+        sheets_client.forget_worksheet(worksheet_name)
+        raise
 
     logger.success(f"{len(rows)} rows added to google sheet")
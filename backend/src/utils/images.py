@@ -0,0 +1,52 @@
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from .file_store import file_dir, file_path
+
+derivative_sizes = (300, 1000)
+cover_size = 3000
+
+
+def convert_image_to_jpeg(data: bytes) -> bytes:
+    image = Image.open(BytesIO(data))
+    image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def derivative_path(file_id: str, size: int) -> Path:
+    return file_dir(file_id)/f'{file_id}_{size}.jpg'
+
+
+def make_image_derivatives(file_id: str) -> dict:
+    """
+    Generate progressive JPEG thumbnails of an uploaded image and check its dimensions
+    against the cover requirements.
+
+    Args:
+        file_id (str): Id of the image, stored as <file_id>.jpg.
+
+    Returns:
+        dict: width, height, cover_size_ok and the generated derivative sizes.
+    """
+    with Image.open(file_path(file_id, 'jpg')) as image:
+        image = image.convert("RGB")
+        width, height = image.size
+
+        for size in derivative_sizes:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.LANCZOS)
+            path = derivative_path(file_id, size)
+            tmp_path = path.with_name(f'.{path.name}.part')
+            thumbnail.save(tmp_path, format="JPEG", quality=85, optimize=True, progressive=True)
+            tmp_path.replace(path)
+
+    return {
+        'width': width,
+        'height': height,
+        'cover_size_ok': width == height == cover_size,
+        'derivatives': list(derivative_sizes),
+    }
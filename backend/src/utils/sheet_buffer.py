@@ -0,0 +1,138 @@
+import asyncio
+
+from loguru import logger
+
+from ..db.release_requests import update_release_request
+from ..db.sheet_rows import (
+    add_pending_sheet_rows, count_pending_sheet_rows, delete_pending_sheet_rows, get_pending_sheet_rows,
+    mark_sheet_rows_written, record_sheet_rows_failure,
+)
+from ..config import sheets_flush_interval, sheets_flush_rows, sheets_max_attempts
+from .google_sheets import is_rows_rejected, write_rows_to_google_sheet
+
+
+class SheetRowBuffer:
+    """
+    Write-behind buffer in front of the Google Sheets writer.
+
+    Rows are persisted in Mongo as soon as they are added and written to the
+    worksheet in one batched call once enough rows are pending or the flush
+    interval passes. Rows are marked written right after the append, so they are
+    not appended twice if a later step fails, and release flags are set only after
+    the write succeeds. Rows the Sheets API keeps rejecting are parked.
+    """
+
+    def __init__(self, max_rows: int, flush_interval: float, max_attempts: int):
+        """
+        Initialize a SheetRowBuffer object.
+
+        Args:
+            max_rows (int): Pending rows per worksheet that trigger a flush.
+            flush_interval (float): Seconds between periodic flushes.
+            max_attempts (int): Rejected writes after which the rows of a release are parked.
+        """
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._pending_rows: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        """
+        Pick up rows left pending by the previous run and start periodic flushing.
+        """
+        self._pending_rows = await count_pending_sheet_rows()
+        self._task = asyncio.create_task(self._flush_periodically())
+        logger.info(f'Sheet row buffer started, pending rows: {self._pending_rows}')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f'Pending sheet rows kept for the next run: {e}')
+
+    async def add_rows(self, worksheet: str, rows: list[list], release_id: str | None = None, flag: str | None = None):
+        """
+        Add rows to the buffer.
+
+        Args:
+            worksheet (str): Name of the worksheet.
+            rows (list[list]): Rows to append, in order.
+            release_id (str | None): Release request the rows belong to.
+            flag (str | None): Release request field set to True once the rows are written.
+        """
+        await add_pending_sheet_rows(worksheet, rows, release_id, flag)
+        self._pending_rows[worksheet] = self._pending_rows.get(worksheet, 0) + len(rows)
+        if self._pending_rows[worksheet] >= self.max_rows:
+            try:
+                await self.flush(worksheet)
+            except Exception as e:
+                # the rows stay in Mongo and go out with the next flush
+                logger.exception(e)
+
+    async def flush(self, worksheet: str | None = None):
+        """
+        Write pending rows, of one worksheet or of all of them, in one call per worksheet.
+        """
+        async with self._lock:
+            worksheets = [worksheet] if worksheet is not None else list(self._pending_rows)
+            for worksheet_name in worksheets:
+                entries = await get_pending_sheet_rows(worksheet_name)
+                if not entries:
+                    self._pending_rows[worksheet_name] = 0
+                    continue
+
+                written = [entry for entry in entries if entry.get('written')]
+                unwritten = [entry for entry in entries if not entry.get('written')]
+                if unwritten:
+                    rows = [row for entry in unwritten for row in entry['rows']]
+                    try:
+                        await asyncio.to_thread(write_rows_to_google_sheet, worksheet_name, rows)
+                        await mark_sheet_rows_written([entry['_id'] for entry in unwritten])
+                        written.extend(unwritten)
+                    except Exception as e:
+                        if not is_rows_rejected(e):
+                            raise
+                        # find the rejected rows by writing the entries one by one
+                        written.extend(await self._write_entries_separately(worksheet_name, unwritten))
+
+                for entry in written:
+                    if entry.get('release_id') and entry.get('flag'):
+                        await update_release_request(entry['release_id'], {entry['flag']: True})
+                await delete_pending_sheet_rows([entry['_id'] for entry in written])
+                written_rows = sum(len(entry['rows']) for entry in written)
+                self._pending_rows[worksheet_name] = max(0, self._pending_rows.get(worksheet_name, 0) - written_rows)
+                logger.info(f'Flushed {written_rows} rows of {len(written)} releases to {worksheet_name}')
+
+    async def _write_entries_separately(self, worksheet_name: str, entries: list[dict]) -> list[dict]:
+        written = []
+        for entry in entries:
+            try:
+                await asyncio.to_thread(write_rows_to_google_sheet, worksheet_name, entry['rows'])
+            except Exception as e:
+                if not is_rows_rejected(e):
+                    raise
+                if await record_sheet_rows_failure(entry['_id'], str(e), self.max_attempts):
+                    logger.error(f'Parked rows of release {entry.get("release_id")} for {worksheet_name} after {self.max_attempts} rejected writes: {e}')
+                continue
+            await mark_sheet_rows_written([entry['_id']])
+            written.append(entry)
+        return written
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not any(self._pending_rows.values()):
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+
+sheet_buffer = SheetRowBuffer(sheets_flush_rows, sheets_flush_interval, sheets_max_attempts)
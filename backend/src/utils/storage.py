@@ -0,0 +1,243 @@
+import asyncio
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from loguru import logger
+
+from ..db.file import (
+    delete_file, get_existing_blob_ids, get_existing_file_ids, get_referenced_file_ids,
+    iter_files_uploaded_before, remove_blob_reference,
+)
+from ..config import download_dir, storage_gc_dry_run, storage_gc_interval, storage_orphan_grace, storage_quota, temp_dir, temp_max_age
+from .file_store import blob_path, blobs_dir, file_dir
+
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+
+def _scan(directory: Path) -> list[tuple[Path, os.stat_result]]:
+    if not directory.is_dir():
+        return []
+    return [(path, path.stat()) for path in directory.iterdir() if path.is_file()]
+
+
+def _subdirectories(directory: Path) -> list[Path]:
+    if not directory.is_dir():
+        return []
+    return [path for path in directory.iterdir() if path.is_dir()]
+
+
+def _unlink(paths: list[Path]) -> int:
+    freed = 0
+    for path in paths:
+        try:
+            freed += path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    return freed
+
+
+def _size(paths: list[Path]) -> int:
+    size = 0
+    for path in paths:
+        try:
+            size += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+
+def _migrate_flat_layout() -> int:
+    """
+    Move files stored directly in download_dir by older versions into their file_dir.
+    """
+    moved = 0
+    for path, _ in _scan(download_dir):
+        file_id = path.name[:24]
+        if len(file_id) != 24 or path.name.startswith('.'):
+            continue
+        target_dir = file_dir(file_id)
+        target_dir.mkdir(exist_ok=True)
+        os.replace(path, target_dir/path.name)
+        moved += 1
+    return moved
+
+
+class StorageManager:
+    """
+    Keeps download_dir and temp_dir bounded.
+
+    A periodic sweep deletes uploads no release request or user data refers to,
+    files and blobs left on disk without a database entry, and stale scratch files in temp_dir.
+    It also measures disk usage, which uploads are checked against when a quota is set.
+    """
+
+    def __init__(self, quota: int, gc_interval: float, orphan_grace: float, temp_max_age: float, dry_run: bool = False):
+        """
+        Initialize a StorageManager object.
+
+        Args:
+            quota (int): Bytes download_dir and temp_dir may take together, 0 for no limit.
+            gc_interval (float): Seconds between sweeps.
+            orphan_grace (float): Age in seconds an unreferenced upload must reach before it is deleted,
+                so files of releases still being filled in are kept.
+            temp_max_age (float): Age in seconds after which files in temp_dir are deleted.
+            dry_run (bool): Make periodic sweeps only report what they would delete.
+        """
+        self.quota = quota
+        self.gc_interval = gc_interval
+        self.orphan_grace = orphan_grace
+        self.temp_max_age = temp_max_age
+        self.dry_run = dry_run
+        self.used_bytes = 0
+        self.usage: dict = {}
+        self.last_gc: dict = {}
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        moved = await asyncio.to_thread(_migrate_flat_layout)
+        if moved:
+            logger.info(f'Moved {moved} files into hashed directories')
+        self._task = asyncio.create_task(self._collect_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def check_quota(self, size: int):
+        """
+        Raise StorageQuotaExceeded if storing size more bytes would go over the quota.
+        """
+        if self.quota and self.used_bytes + size > self.quota:
+            raise StorageQuotaExceeded(f'Storage quota of {self.quota} bytes exceeded')
+
+    def add_usage(self, size: int):
+        # corrected by the next sweep, which measures the disk
+        self.used_bytes += size
+
+    def metrics(self) -> dict:
+        disk = shutil.disk_usage(download_dir if download_dir.exists() else download_dir.parent)
+        return {
+            'used_bytes': self.used_bytes,
+            'quota_bytes': self.quota or None,
+            'disk_free_bytes': disk.free,
+            **self.usage,
+            'last_gc': self.last_gc,
+        }
+
+    async def collect_garbage(self, dry_run: bool | None = None) -> dict:
+        """
+        Run one sweep.
+
+        Args:
+            dry_run (bool | None): Only report what would be deleted, the manager's setting by default.
+
+        Returns:
+            dict: Number of deleted file documents, files and blobs and the bytes freed,
+                with the ids of the deleted file documents in a dry run.
+        """
+        if dry_run is None:
+            dry_run = self.dry_run
+        remove = _size if dry_run else _unlink
+        async with self._lock:
+            started = time.perf_counter()
+            stats = {'started_at': datetime.utcnow(), 'dry_run': dry_run, 'files': 0, 'orphans': 0, 'blobs': 0, 'temp': 0, 'freed_bytes': 0}
+            if dry_run:
+                stats['file_ids'] = []
+            now = time.time()
+            upload_cutoff = (datetime.utcnow() - timedelta(seconds=self.orphan_grace)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+            referenced = await get_referenced_file_ids()
+            async for file in iter_files_uploaded_before(upload_cutoff):
+                if file['id'] in referenced:
+                    continue
+                if dry_run:
+                    stats['freed_bytes'] += await asyncio.to_thread(_size, self._upload_paths(file['id']))
+                    stats['file_ids'].append(file['id'])
+                else:
+                    stats['freed_bytes'] += await self._delete_upload(file)
+                stats['files'] += 1
+
+            for directory in await asyncio.to_thread(_subdirectories, download_dir):
+                if directory == blobs_dir:
+                    continue
+                entries = [(path, stat) for path, stat in await asyncio.to_thread(_scan, directory) if now - stat.st_mtime > self.orphan_grace]
+                existing = await get_existing_file_ids(list({path.name[:24] for path, _ in entries}))
+                # temporary link names start with a dot and never belong to a file
+                orphans = [path for path, _ in entries if path.name.startswith('.') or path.name[:24] not in existing]
+                stats['freed_bytes'] += await asyncio.to_thread(remove, orphans)
+                stats['orphans'] += len(orphans)
+
+            for directory in await asyncio.to_thread(_subdirectories, blobs_dir):
+                entries = [(path, stat) for path, stat in await asyncio.to_thread(_scan, directory) if now - stat.st_mtime > self.orphan_grace]
+                if directory.name == 'tmp':
+                    orphans = [path for path, _ in entries]
+                else:
+                    existing = await get_existing_blob_ids([path.name for path, _ in entries])
+                    orphans = [path for path, _ in entries if path.name not in existing]
+                stats['freed_bytes'] += await asyncio.to_thread(remove, orphans)
+                stats['blobs'] += len(orphans)
+
+            stale = [path for path, stat in await asyncio.to_thread(_scan, temp_dir) if now - stat.st_mtime > self.temp_max_age]
+            stats['freed_bytes'] += await asyncio.to_thread(remove, stale)
+            stats['temp'] = len(stale)
+
+            self.usage = await asyncio.to_thread(self._measure)
+            self.used_bytes = self.usage['download_bytes'] + self.usage['temp_bytes']
+            stats['duration'] = round(time.perf_counter() - started, 3)
+            self.last_gc = stats
+            logger.info(f'Storage sweep: {stats}, usage: {self.usage}')
+            return stats
+
+    @staticmethod
+    def _upload_paths(file_id: str) -> list[Path]:
+        directory = file_dir(file_id)
+        # covers the upload-time MP3, previews and image derivatives
+        return [*directory.glob(f'{file_id}.*'), *directory.glob(f'{file_id}_*')]
+
+    async def _delete_upload(self, file: dict) -> int:
+        file_id = file['id']
+        freed = await asyncio.to_thread(_unlink, self._upload_paths(file_id))
+
+        sha256 = file.get('sha256')
+        if sha256 is not None and not file.get('released'):
+            if await remove_blob_reference(sha256) <= 0:
+                freed += await asyncio.to_thread(_unlink, [blob_path(sha256)])
+        await delete_file(file_id)
+        return freed
+
+    def _measure(self) -> dict:
+        seen = set()
+        usage = {'download_bytes': 0, 'download_files': 0, 'blob_files': 0, 'temp_bytes': 0, 'temp_files': 0}
+        if download_dir.exists():
+            for root, _, names in os.walk(download_dir):
+                for name in names:
+                    stat = os.stat(os.path.join(root, name))
+                    usage['blob_files' if root.startswith(str(blobs_dir)) else 'download_files'] += 1
+                    # uploads are hard links to their blob, count the content once
+                    if (stat.st_dev, stat.st_ino) not in seen:
+                        seen.add((stat.st_dev, stat.st_ino))
+                        usage['download_bytes'] += stat.st_size
+        for _, stat in _scan(temp_dir):
+            usage['temp_bytes'] += stat.st_size
+            usage['temp_files'] += 1
+        return usage
+
+    async def _collect_periodically(self):
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self.gc_interval)
+
+
+storage_manager = StorageManager(storage_quota, storage_gc_interval, storage_orphan_grace, temp_max_age, dry_run=storage_gc_dry_run)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from loguru import logger
+
+from ..config import transcode_workers
+
+MP3_PROFILES = {
+    # same output as the previous pydub export (ffmpeg libmp3lame defaults)
+    "standard": ["-codec:a", "libmp3lame", "-b:a", "128k"],
+    "high": ["-codec:a", "libmp3lame", "-b:a", "320k"],
+    "v0": ["-codec:a", "libmp3lame", "-q:a", "0"],
+}
+
+_executor: ProcessPoolExecutor | None = None
+
+
+class TranscodingError(Exception):
+    pass
+
+
+def transcode_to_mp3(src_path: Path, dst_path: Path, profile: str = "standard", bitrate: str | None = None,
+                     start: float | None = None, duration: float | None = None) -> Path:
+    """
+    Transcode an audio file to MP3 by streaming it through ffmpeg.
+
+    ffmpeg decodes and encodes frame by frame, so memory use does not depend
+    on the length of the source file.
+
+    Args:
+        src_path (Path): Path to the source file.
+        dst_path (Path): Path to write the MP3 to.
+        profile (str): Name of an encoding profile from MP3_PROFILES.
+        bitrate (str | None): Constant bitrate overriding the profile, e.g. "256k".
+        start (float | None): Offset in seconds to start from. The input is seeked,
+            so the audio before it is not decoded.
+        duration (float | None): Length of the output in seconds.
+
+    Returns:
+        Path: Path to the MP3 file.
+    """
+    if profile not in MP3_PROFILES:
+        raise TranscodingError(f"Unknown MP3 profile: {profile}")
+
+    codec_args = list(MP3_PROFILES[profile])
+    if bitrate is not None:
+        codec_args = ["-codec:a", "libmp3lame", "-b:a", bitrate]
+
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    # write next to the destination and rename, so readers never see a partial MP3
+    tmp_path = dst_path.with_name(f".{dst_path.name}.part")
+    seek_args = ["-ss", f"{start:.3f}"] if start else []
+    duration_args = ["-t", f"{duration:.3f}"] if duration is not None else []
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+        *seek_args, "-i", src_path.as_posix(),
+        "-vn", *duration_args, *codec_args,
+        "-f", "mp3", tmp_path.as_posix(),
+    ]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        tmp_path.unlink(missing_ok=True)
+        raise TranscodingError(result.stderr.decode(errors="replace").strip())
+
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=transcode_workers)
+        logger.info(f"Transcoding pool started with {transcode_workers} workers")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def transcode_to_mp3_async(src_path: Path, dst_path: Path, profile: str = "standard", bitrate: str | None = None,
+                                 start: float | None = None, duration: float | None = None) -> Path:
+    """
+    Transcode an audio file to MP3 in the transcoding process pool.
+
+    Args:
+        src_path (Path): Path to the source file.
+        dst_path (Path): Path to write the MP3 to.
+        profile (str): Name of an encoding profile from MP3_PROFILES.
+        bitrate (str | None): Constant bitrate overriding the profile, e.g. "256k".
+        start (float | None): Offset in seconds to start from.
+        duration (float | None): Length of the output in seconds.
+
+    Returns:
+        Path: Path to the MP3 file.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(transcode_to_mp3, src_path, dst_path, profile, bitrate, start, duration))
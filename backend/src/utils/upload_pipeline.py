@@ -0,0 +1,170 @@
+import asyncio
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from ..db.file import get_file_by_id, update_file
+from ..config import mp3_bitrate, mp3_profile, preview_duration
+from .audio_analysis import analyze_wav
+from .file_store import file_dir, file_path
+from .images import make_image_derivatives
+from .waveform import compute_peaks
+from .transcoding import transcode_to_mp3_async
+from .wavFile import convert_wav_to_mp3, parse_duration, read_wav_info
+
+
+async def extract_audio_metadata(file_id: str):
+    audio = await asyncio.to_thread(read_wav_info, file_path(file_id, 'wav'))
+    await update_file(file_id, {'audio': audio})
+
+
+async def transcode_mp3(file_id: str):
+    await update_file(file_id, {'mp3': {'status': 'running', 'profile': mp3_profile}})
+    mp3_path = await convert_wav_to_mp3(file_id)
+    if mp3_path is None:
+        await update_file(file_id, {'mp3.status': 'failed'})
+        return
+    await update_file(file_id, {'mp3.status': 'done', 'mp3.name': mp3_path.name})
+
+
+async def analyze_audio(file_id: str):
+    analysis = await asyncio.to_thread(analyze_wav, file_path(file_id, 'wav'))
+    await update_file(file_id, {'analysis': analysis})
+
+
+async def extract_waveform(file_id: str):
+    waveform = await asyncio.to_thread(compute_peaks, file_path(file_id, 'wav'))
+    await update_file(file_id, {'waveform': waveform})
+
+
+async def process_image(file_id: str):
+    image = await asyncio.to_thread(make_image_derivatives, file_id)
+    await update_file(file_id, {'image': image})
+
+
+upload_stages: dict[str, list[Callable[[str], Awaitable]]] = {
+    'wav': [extract_audio_metadata, analyze_audio, extract_waveform, transcode_mp3],
+    **{extension: [process_image] for extension in ['jpg', 'jpeg', 'png', 'bmp', 'tiff', 'gif']},
+}
+
+
+async def process_upload(file_id: str, extension: str):
+    """
+    Run the upload-time stages registered for the file extension.
+    Stages are independent, so they run concurrently and a failing stage does not stop the others.
+
+    Args:
+        file_id (str): Id of the uploaded file.
+        extension (str): Extension of the uploaded file.
+    """
+    stages = upload_stages.get(extension.lower(), [])
+    results = await asyncio.gather(*(stage(file_id) for stage in stages), return_exceptions=True)
+    for stage, result in zip(stages, results):
+        if isinstance(result, Exception):
+            logger.opt(exception=result).error(f"Upload stage {stage.__name__} failed for file {file_id}")
+
+
+async def get_track_mp3(file_id: str) -> Path | None:
+    """
+    Get the MP3 produced at upload time, converting the WAV now if it is missing.
+    """
+    file = await get_file_by_id(file_id)
+    mp3 = (file or {}).get('mp3') or {}
+    if mp3.get('status') == 'done' and mp3.get('profile') == mp3_profile:
+        mp3_path = file_dir(file_id)/mp3.get('name')
+        if mp3_path.exists():
+            return mp3_path
+    return await convert_wav_to_mp3(file_id)
+
+
+def preview_path(file_id: str, start: float) -> Path:
+    # the offset is part of the name, so a recut clip never overwrites the one being served
+    return file_dir(file_id)/f'{file_id}_preview_{int(start * 1000)}.mp3'
+
+
+class PreviewOffsetError(Exception):
+    pass
+
+
+def _clamp_preview_start(file: dict, start: float) -> float:
+    duration = (file.get('audio') or {}).get('duration')
+    if duration is not None:
+        # keep the whole clip inside the track
+        start = max(min(start, duration - preview_duration), 0)
+    return start
+
+
+async def get_track_preview(file_id: str, start: float | None = None) -> Path | None:
+    """
+    Get the stored preview clip of a track. Clips are only cut by make_release_previews,
+    so reading one never changes the file.
+
+    Args:
+        file_id (str): Id of the WAV file.
+        start (float | None): Expected offset of the clip in seconds, any offset by default.
+
+    Returns:
+        Path | None: Path to the MP3 clip, None if there is no clip.
+
+    Raises:
+        PreviewOffsetError: If the stored clip starts at another offset.
+    """
+    file = await get_file_by_id(file_id)
+    preview = (file or {}).get('preview') or {}
+    if preview.get('name') is None:
+        return None
+    if start is not None and _clamp_preview_start(file, start) != preview.get('start'):
+        raise PreviewOffsetError(f"Preview of {file_id} starts at {preview.get('start')} seconds")
+    clip_path = file_dir(file_id)/preview['name']
+    if not clip_path.exists():
+        return None
+    return clip_path
+
+
+async def make_track_preview(file_id: str, start: float) -> Path | None:
+    """
+    Cut the preview clip of a track from the WAV and store it as the track's preview,
+    replacing the clip cut at another offset.
+
+    Args:
+        file_id (str): Id of the WAV file.
+        start (float): Offset of the clip in seconds.
+
+    Returns:
+        Path | None: Path to the MP3 clip, None if it could not be made.
+    """
+    file = await get_file_by_id(file_id)
+    if file is None or file.get('extension') != 'wav':
+        return None
+
+    preview = file.get('preview') or {}
+    start = _clamp_preview_start(file, start)
+    clip_path = preview_path(file_id, start)
+    if not clip_path.exists():
+        wav_path = file_path(file_id, 'wav')
+        try:
+            await transcode_to_mp3_async(wav_path, clip_path, profile=mp3_profile, bitrate=mp3_bitrate, start=start, duration=preview_duration)
+        except Exception as e:
+            logger.error(f"Error cutting preview of {wav_path.name}: {e}")
+            return None
+
+    if preview.get('name') not in (None, clip_path.name):
+        (file_dir(file_id)/preview['name']).unlink(missing_ok=True)
+    await update_file(file_id, {'preview': {'start': start, 'name': clip_path.name}})
+    return clip_path
+
+
+async def make_release_previews(release_data: dict):
+    """
+    Cut the preview clips of all uploaded tracks of a release, starting at their preview timestamps.
+    """
+    for track in release_data.get('tracks') or []:
+        if not track.get('wav_file_id'):
+            continue
+        try:
+            start = parse_duration(track.get('preview') or '0:00')
+        except ValueError:
+            logger.warning(f"Bad preview timestamp {track.get('preview')!r} of file {track['wav_file_id']}")
+            start = 0
+        await make_track_preview(track['wav_file_id'], start)
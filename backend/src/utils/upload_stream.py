@@ -0,0 +1,128 @@
+from typing import AsyncIterator
+
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class MultipartFileStream:
+    """
+    Reads one file field of a multipart/form-data request straight from the request body,
+    without spooling the whole upload to a temporary file first.
+    """
+
+    def __init__(self, request: Request, field_name: str = 'file'):
+        """
+        Initialize a MultipartFileStream object.
+
+        Args:
+            request (Request): Incoming request with a multipart/form-data body.
+            field_name (str): Name of the form field holding the file.
+        """
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise ValueError('Expected a multipart/form-data body')
+
+        self.field_name = field_name.encode()
+        self.filename: str | None = None
+        self._body = request.stream()
+        self._parser = MultipartParser(params[b'boundary'], callbacks={
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._in_file = False
+        self._file_done = False
+        self._body_done = False
+        self._pending: list[bytes] = []
+        self._pending_size = 0
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        if self.filename is None and options.get(b'name') == self.field_name and b'filename' in options:
+            self.filename = options[b'filename'].decode(errors='replace')
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+            self._pending_size += end - start
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> bool:
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            self._parser.finalize()
+            self._body_done = True
+            return False
+        self._parser.write(chunk)
+        return True
+
+    async def open(self) -> str:
+        """
+        Read the body up to the start of the file content.
+
+        Returns:
+            str: Name of the uploaded file.
+        """
+        while self.filename is None:
+            if not await self._feed():
+                raise ValueError(f'No {self.field_name.decode()} field in the request')
+        return self.filename
+
+    async def chunks(self, max_size: int, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """
+        Iterate over the file content in chunks of about chunk_size bytes.
+
+        Args:
+            max_size (int): Size limit; UploadTooLarge is raised as soon as it is exceeded.
+            chunk_size (int): Size the body pieces are coalesced to before they are yielded.
+        """
+        size = 0
+        while True:
+            while not self._file_done and self._pending_size < chunk_size:
+                if not await self._feed():
+                    break
+
+            data = b''.join(self._pending)
+            self._pending.clear()
+            self._pending_size = 0
+            if data:
+                size += len(data)
+                if size > max_size:
+                    raise UploadTooLarge(f'{self.filename} is larger than {max_size} bytes')
+                yield data
+
+            if self._file_done:
+                return
+            if self._body_done:
+                raise ValueError(f'Request body ended before the end of {self.filename}')
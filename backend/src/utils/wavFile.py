@@ -1,10 +1,15 @@
+import asyncio
+import struct
 from pathlib import Path
-from mutagen import File
-from pydub import AudioSegment
+from typing import Iterator
 
+import numpy as np
 from loguru import logger
 
-from ..config import download_dir, temp_dir
+from ..db.file import get_file_by_id, update_file
+from ..config import mp3_profile, mp3_bitrate
+from .file_store import file_dir, file_path as local_file_path
+from .transcoding import transcode_to_mp3_async
 
 def format_duration(seconds):
     minutes = int(seconds // 60)
@@ -12,35 +17,160 @@ def format_duration(seconds):
     return f"{minutes}:{seconds:02d}"
 
 
-def get_wav_duration(file_id: str, raw: bool = False) -> str | int | None:
-    file_path = download_dir/f"{file_id}.wav"
-    print(file_path)
-    try:
-        audio = File(file_path)
-        print(audio)
-        if audio is not None and hasattr(audio, 'info') and hasattr(audio.info, 'length'):
-            duration = audio.info.length
-            logger.debug(f"Duration: {duration}, type: {type(duration)}")
-            if raw:
-                return duration
-            return format_duration(duration)
-    except Exception as e:
-        logger.error(f"Error processing {file_path.name}: {e}")
-        return None
+def parse_duration(duration: str) -> float:
+    minutes, _, seconds = duration.strip().rpartition(':')
+    return int(minutes or 0) * 60 + float(seconds)
+
+
+class WavHeaderError(Exception):
+    pass
+
+
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav_info(file_path: Path) -> dict:
+    """
+    Read audio metadata from the RIFF header of a WAV file without touching the samples.
+    RF64 files (WAVs over 4 GB) are supported through their ds64 chunk.
+
+    Args:
+        file_path (Path): Path to the WAV file.
+
+    Returns:
+        dict: duration, sample_rate, bit_depth, channels, frames, audio_format,
+            data_offset and data_size of the file.
+    """
+    file_size = file_path.stat().st_size
+    with open(file_path, 'rb') as file:
+        riff_id, _, wave_id = struct.unpack('<4sI4s', file.read(12))
+        if riff_id not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+            raise WavHeaderError(f'{file_path.name} is not a WAV file')
+
+        fmt = None
+        ds64_data_size = None
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise WavHeaderError(f'{file_path.name} has no data chunk')
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                fmt = file.read(chunk_size)
+            elif chunk_id == b'ds64':
+                ds64 = file.read(chunk_size)
+                ds64_data_size = struct.unpack('<Q', ds64[8:16])[0]
+            elif chunk_id == b'data':
+                data_offset = file.tell()
+                data_size = ds64_data_size if chunk_size == 0xFFFFFFFF and ds64_data_size is not None else chunk_size
+                break
+            else:
+                file.seek(chunk_size, 1)
+            # chunks are word aligned
+            if chunk_size % 2:
+                file.seek(1, 1)
+
+    if fmt is None or len(fmt) < 16:
+        raise WavHeaderError(f'{file_path.name} has no fmt chunk')
+
+    audio_format, channels, sample_rate, _, block_align, bit_depth = struct.unpack('<HHIIHH', fmt[:16])
+    if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # the actual format is the first two bytes of the sub-format GUID
+        audio_format = struct.unpack('<H', fmt[24:26])[0]
+
+    # files written by streaming encoders may declare more data than they hold
+    data_size = min(data_size, file_size - data_offset)
+    frames = data_size // block_align if block_align else 0
 
+    return {
+        'duration': frames / sample_rate if sample_rate else 0,
+        'sample_rate': sample_rate,
+        'bit_depth': bit_depth,
+        'channels': channels,
+        'frames': frames,
+        'audio_format': audio_format,
+        'data_offset': data_offset,
+        'data_size': data_size,
+    }
 
-def convert_wav_to_mp3(file_id: str) -> Path:
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    wav_path = download_dir/f"{file_id}.wav"
-    mp3_path = temp_dir/f"{file_id}.mp3"
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def iter_wav_blocks(file_path: Path, info: dict, block_frames: int = 1 << 18) -> Iterator[np.ndarray]:
+    """
+    Iterate over the samples of a WAV file in blocks, reading through a memory map,
+    so memory use is bounded by the block size whatever the length of the file.
+
+    Args:
+        file_path (Path): Path to the WAV file.
+        info (dict): Header info returned by read_wav_info.
+        block_frames (int): Number of frames per block.
+
+    Returns:
+        Iterator[np.ndarray]: float32 arrays of shape (frames, channels) with samples in [-1, 1].
+    """
+    channels, bit_depth, frames = info['channels'], info['bit_depth'], info['frames']
+    sample_width = bit_depth // 8
+    if not frames or info['audio_format'] not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or sample_width not in (1, 2, 3, 4, 8):
+        raise WavHeaderError(f'{file_path.name}: unsupported sample format {info["audio_format"]}/{bit_depth} bit')
+
+    frame_size = channels * sample_width
+    for start in range(0, frames, block_frames):
+        # map one block at a time, so pages already read are released instead of piling up in RSS
+        length = min(block_frames, frames - start)
+        data = np.memmap(file_path, dtype=np.uint8, mode='r', offset=info['data_offset'] + start * frame_size, shape=(length, channels, sample_width))
+        raw = np.array(data)
+        del data
+        if info['audio_format'] == WAVE_FORMAT_IEEE_FLOAT:
+            samples = raw.view('<f4' if sample_width == 4 else '<f8')[..., 0].astype(np.float32)
+        elif sample_width == 1:
+            # 8 bit PCM is unsigned
+            samples = (raw[..., 0].astype(np.float32) - 128) / 128
+        elif sample_width == 3:
+            packed = raw.astype(np.int32)
+            samples = ((packed[..., 0] << 8 | packed[..., 1] << 16 | packed[..., 2] << 24) >> 8).astype(np.float32) / (1 << 23)
+        else:
+            dtype = '<i2' if sample_width == 2 else '<i4'
+            samples = raw.view(dtype)[..., 0].astype(np.float32) / (1 << (bit_depth - 1))
+        yield samples
+
+
+async def get_wav_duration(file_id: str, raw: bool = False) -> str | float | None:
+    """
+    Get the duration of an uploaded WAV from the metadata stored on its files document,
+    parsing the WAV header and storing the result only when it is missing.
+    """
+    file = await get_file_by_id(file_id)
+    duration = ((file or {}).get('audio') or {}).get('duration')
+
+    if duration is None:
+        file_path = local_file_path(file_id, "wav")
+        try:
+            audio = await asyncio.to_thread(read_wav_info, file_path)
+        except Exception as e:
+            logger.error(f"Error processing {file_path.name}: {e}")
+            return None
+        duration = audio['duration']
+        if file is not None:
+            await update_file(file_id, {'audio': audio})
+
+    if raw:
+        return duration
+    return format_duration(duration)
+
+
+def mp3_path(file_id: str, profile: str = mp3_profile) -> Path:
+    # kept next to the upload, so it is deleted together with it
+    return file_dir(file_id)/f"{file_id}_{profile}.mp3"
+
+
+async def convert_wav_to_mp3(file_id: str, profile: str = mp3_profile, bitrate: str | None = mp3_bitrate) -> Path | None:
+    wav_path = local_file_path(file_id, "wav")
     try:
-        # Load the WAV file
-        audio = AudioSegment.from_wav(wav_path)
-        # Export as MP3
-        audio.export(mp3_path, format="mp3")
-        return mp3_path
-    
+        return await transcode_to_mp3_async(wav_path, mp3_path(file_id, profile), profile=profile, bitrate=bitrate)
+
     except Exception as e:
         logger.error(f"Error processing {wav_path.name}: {e}")
         return None
-    
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import numpy as np
+
+from .wavFile import iter_wav_blocks, read_wav_info
+
+peaks_buckets = 2000
+
+
+def compute_peaks(file_path: Path, buckets: int = peaks_buckets) -> dict:
+    """
+    Compute min/max peaks of a WAV file for drawing its waveform.
+    Channels are merged, every bucket keeps the lowest and the highest sample of its frames.
+
+    Args:
+        file_path (Path): Path to the WAV file.
+        buckets (int): Maximum number of buckets.
+
+    Returns:
+        dict: buckets, bucket_frames, sample_rate and peaks, the int8 min/max pairs
+            of every bucket as bytes.
+    """
+    info = read_wav_info(file_path)
+    frames = info['frames']
+    bucket_frames = max(-(-frames // buckets), 1)
+    # blocks hold whole buckets, so no bucket is split between two blocks
+    block_frames = bucket_frames * max((1 << 18) // bucket_frames, 1)
+
+    minimums, maximums = [], []
+    for block in iter_wav_blocks(file_path, info, block_frames):
+        starts = np.arange(0, len(block), bucket_frames)
+        minimums.append(np.minimum.reduceat(block.min(axis=1), starts))
+        maximums.append(np.maximum.reduceat(block.max(axis=1), starts))
+
+    peaks = np.empty((sum(len(block) for block in minimums), 2), dtype=np.float32)
+    peaks[:, 0] = np.concatenate(minimums)
+    peaks[:, 1] = np.concatenate(maximums)
+    peaks = np.clip(np.round(peaks * 127), -128, 127).astype(np.int8)
+
+    return {
+        'buckets': len(peaks),
+        'bucket_frames': bucket_frames,
+        'sample_rate': info['sample_rate'],
+        'peaks': peaks.tobytes(),
+    }
@@ -1,9 +1,17 @@
+import asyncio
+import hashlib
+import shutil
 from pathlib import Path
 import pprint
 
+import httpx
 import yadisk
+from cachetools import TTLCache
 from loguru import logger
 
+from ..db.yadisk_cache import delete_yadisk_cache_entries, get_yadisk_cache_entry, set_yadisk_cache_entry
+from ..config import yadisk_backend, yadisk_local_root, yadisk_pool_size, yadisk_timeout, yadisk_upload_timeout, yadisk_cache_ttl, yadisk_cache_persistent_ttl
+
 YANDEX_DISK_TOKEN='y0_AgAAAAAoTDFjAAk4ZQAAAADdl6Wv9pI3krJ1Q5-INSoZ6ujoR6VjKoM'
 
 YANDEX_LINK = "https://disk.yandex.ru/d/Td1MZlXz2wZlfQ"
@@ -120,4 +128,422 @@ class YandexApi:
 
 
 def get_yadisk_api():
-    return YandexApi(YANDEX_DISK_TOKEN)
\ No newline at end of file
+    return YandexApi(YANDEX_DISK_TOKEN)
+
+class AsyncYandexApi:
+    api_url = "https://cloud-api.yandex.net/v1/disk"
+    chunk_size = 1024 * 1024
+
+    def __init__(self, token: str, pool_size: int = 10, timeout: float = 30, upload_timeout: float = 600):
+        """
+        Initialize an AsyncYandexApi object.
+
+        Args:
+            token (str): Yandex Disk API token.
+            pool_size (int): Maximum number of pooled keep-alive connections.
+            timeout (float): Timeout for API calls, in seconds.
+            upload_timeout (float): Timeout for file transfers, in seconds.
+        """
+        self.upload_timeout = upload_timeout
+        self.client = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers={"Authorization": f"OAuth {token}"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout),
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    # 409 error codes meaning the destination is already there
+    exists_errors = ("DiskResourceAlreadyExistsError", "DiskPathPointsToExistentDirectoryError")
+
+    @staticmethod
+    def _error_code(response: httpx.Response) -> str | None:
+        try:
+            return response.json().get("error")
+        except ValueError:
+            return None
+
+    def _check_conflict(self, response: httpx.Response, path: str) -> bool:
+        """
+        Tell whether a 409 response means the path already exists.
+        A missing parent directory raises ParentNotFoundError, other conflicts raise HTTPStatusError.
+        """
+        error = self._error_code(response)
+        if error in self.exists_errors:
+            return True
+        if error == "DiskPathDoesntExistsError":
+            raise yadisk.exceptions.ParentNotFoundError(error, f"Parent directory of {path} does not exist on Yadisk")
+        response.raise_for_status()
+
+
+    async def publish(self, path: str) -> str | None:
+        try:
+            response = await self.client.put("/resources/publish", params={"path": path})
+            if response.status_code == 404:
+                raise yadisk.exceptions.PathNotFoundError(self._error_code(response), f"Path to publish: {path} not found on Yadisk")
+            response.raise_for_status()
+            response = await self.client.get("/resources", params={"path": path, "fields": "public_url"})
+            response.raise_for_status()
+            return response.json().get("public_url")
+        except yadisk.exceptions.PathNotFoundError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+
+
+    async def remove(self, path: str):
+        try:
+            response = await self.client.delete("/resources", params={"path": path, "permanently": "true"})
+            if response.status_code == 404:
+                logger.warning(f"Path to remove: {path} not found on Yadisk")
+                return
+            response.raise_for_status()
+        except Exception as e:
+            logger.exception(e)
+
+
+    async def download_file(self, disk_path: str, download_path: Path) -> bool:
+        """
+        Download a file from Yandex Disk.
+
+        Args:
+            disk_path (str): Path to the file on Yandex Disk.
+            download_path (Path): Path to save the downloaded file.
+
+        Returns:
+            bool: True if download was successful, False otherwise.
+        """
+        download_path.parent.mkdir(parents=True, exist_ok=True)
+        status = False
+        try:
+            response = await self.client.get("/resources/download", params={"path": disk_path})
+            if response.status_code == 404:
+                logger.warning(f"File {disk_path} not found on Yadisk")
+                return status
+            response.raise_for_status()
+
+            href = response.json()["href"]
+            async with self.client.stream("GET", href, follow_redirects=True, timeout=self.upload_timeout) as download:
+                download.raise_for_status()
+                with open(download_path, "wb") as buffer:
+                    async for chunk in download.aiter_bytes(self.chunk_size):
+                        buffer.write(chunk)
+            status = True
+            logger.debug(f"Download path {download_path.as_posix()}")
+            logger.success(f"File {download_path.name} downloaded from YaDisk")
+
+        except Exception as e:
+            logger.exception(e)
+
+        if not status:
+            download_path.unlink(missing_ok=True)
+        return status
+
+
+    async def upload_file(self, local_path: Path, dst_path: str) -> str | bool | None:
+        """
+        Upload a local file to Yandex Disk.
+
+        Args:
+            local_path (Path): Path to the local file.
+            dst_path (str): Destination path on Yandex Disk.
+
+        Returns:
+            str: Path to the uploaded file on Yandex Disk.
+        """
+        if not local_path.exists():
+            logger.warning(f"File {local_path} not found")
+            return False
+        try:
+            response = await self.client.get("/resources/upload", params={"path": dst_path, "overwrite": "false"})
+            if response.status_code == 409 and self._check_conflict(response, dst_path):
+                logger.warning(f"File {dst_path} already exists")
+                return True
+            response.raise_for_status()
+
+            href = response.json()["href"]
+            upload = await self.client.put(
+                href,
+                content=self._read_chunks(local_path),
+                headers={"Content-Length": str(local_path.stat().st_size)},
+                timeout=self.upload_timeout,
+            )
+            upload.raise_for_status()
+            return dst_path
+        except yadisk.exceptions.ParentNotFoundError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+
+
+    async def copy(self, src_path: str, dst_path: str) -> bool:
+        """
+        Copy a file on Yandex Disk without transferring its content.
+
+        Args:
+            src_path (str): Path to the existing file on Yandex Disk.
+            dst_path (str): Destination path on Yandex Disk.
+
+        Returns:
+            bool: True if the destination holds the file, False otherwise.
+        """
+        try:
+            response = await self.client.post("/resources/copy", params={"from": src_path, "path": dst_path, "overwrite": "false"})
+            if response.status_code == 404:
+                logger.warning(f"Path to copy: {src_path} not found on Yadisk")
+                return False
+            if response.status_code == 409 and self._check_conflict(response, dst_path):
+                logger.warning(f"File {dst_path} already exists")
+                return True
+            response.raise_for_status()
+            if response.status_code == 202:
+                # large copies run as an asynchronous operation on the Disk side
+                operation_href = response.json()["href"]
+                while True:
+                    await asyncio.sleep(0.5)
+                    operation = await self.client.get(operation_href)
+                    operation.raise_for_status()
+                    status = operation.json().get("status")
+                    if status != "in-progress":
+                        return status == "success"
+            return True
+        except yadisk.exceptions.ParentNotFoundError:
+            raise
+        except Exception as e:
+            logger.exception(e)
+            return False
+
+
+    async def create_service_dir(self, path: str):
+        """
+        Create directories on Yandex Disk for the specified path.
+
+        Args:
+            path (str): Path to create directories for.
+        """
+        response = await self.client.put("/resources", params={"path": path})
+        if response.status_code == 409 and self._check_conflict(response, path):
+            return
+        response.raise_for_status()
+
+
+    async def _read_chunks(self, local_path: Path):
+        with open(local_path, "rb") as file:
+            while chunk := await asyncio.to_thread(file.read, self.chunk_size):
+                yield chunk
+
+
+class LocalYandexApi:
+    """
+    Offline stand-in for AsyncYandexApi that keeps the disk in a local directory.
+    Public links are derived from the path, so they are stable between runs.
+    """
+
+    public_url_prefix = "https://disk.yandex.ru/d/local-"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    async def close(self):
+        pass
+
+    def _local(self, path: str) -> Path:
+        return self.root/path.lstrip("/")
+
+
+    async def publish(self, path: str) -> str | None:
+        if not self._local(path).exists():
+            raise yadisk.exceptions.PathNotFoundError("DiskNotFoundError", f"Path to publish: {path} not found on Yadisk")
+        return self.public_url_prefix + hashlib.sha1(path.encode()).hexdigest()[:14]
+
+
+    async def remove(self, path: str):
+        local_path = self._local(path)
+        if not local_path.exists():
+            logger.warning(f"Path to remove: {path} not found on Yadisk")
+        elif local_path.is_dir():
+            await asyncio.to_thread(shutil.rmtree, local_path)
+        else:
+            local_path.unlink()
+
+
+    async def download_file(self, disk_path: str, download_path: Path) -> bool:
+        if not self._local(disk_path).is_file():
+            logger.warning(f"File {disk_path} not found on Yadisk")
+            return False
+        download_path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, self._local(disk_path), download_path)
+        return True
+
+
+    async def upload_file(self, local_path: Path, dst_path: str) -> str | bool | None:
+        destination = self._local(dst_path)
+        if destination.exists():
+            logger.warning(f"File {dst_path} already exists")
+            return True
+        if not local_path.exists():
+            logger.warning(f"File {local_path} not found")
+            return False
+        if not destination.parent.is_dir():
+            raise yadisk.exceptions.ParentNotFoundError("DiskPathDoesntExistsError", f"Parent directory of {dst_path} does not exist on Yadisk")
+        await asyncio.to_thread(shutil.copyfile, local_path, destination)
+        return dst_path
+
+
+    async def copy(self, src_path: str, dst_path: str) -> bool:
+        if not self._local(src_path).is_file():
+            logger.warning(f"Path to copy: {src_path} not found on Yadisk")
+            return False
+        if self._local(dst_path).exists():
+            logger.warning(f"File {dst_path} already exists")
+            return True
+        if not self._local(dst_path).parent.is_dir():
+            raise yadisk.exceptions.ParentNotFoundError("DiskPathDoesntExistsError", f"Parent directory of {dst_path} does not exist on Yadisk")
+        await asyncio.to_thread(shutil.copyfile, self._local(src_path), self._local(dst_path))
+        return True
+
+
+    async def create_service_dir(self, path: str):
+        # like the Disk API, the parent directory has to exist already
+        if not self._local(path).parent.is_dir():
+            raise yadisk.exceptions.ParentNotFoundError("DiskPathDoesntExistsError", f"Parent directory of {path} does not exist on Yadisk")
+        self._local(path).mkdir(exist_ok=True)
+
+
+class CachedYandexApi:
+    """
+    Wraps AsyncYandexApi or LocalYandexApi with a cache of directories known to exist
+    and of public links of published paths, so repeated mkdir and publish calls
+    skip the Disk API. Entries live in process memory for memory_ttl seconds and
+    in the yadisk_cache collection for persistent_ttl seconds, to survive restarts.
+    """
+
+    def __init__(self, api: AsyncYandexApi | LocalYandexApi, memory_ttl: float, persistent_ttl: float):
+        self.api = api
+        self.persistent_ttl = persistent_ttl
+        self._entries: TTLCache = TTLCache(maxsize=10000, ttl=memory_ttl)
+
+    async def close(self):
+        await self.api.close()
+
+    async def _get_entry(self, path: str) -> dict:
+        entry = self._entries.get(path)
+        if entry is None:
+            entry = await get_yadisk_cache_entry(path) or {}
+            if entry:
+                self._entries[path] = entry
+        return entry
+
+    async def _set_entry(self, path: str, data: dict):
+        entry = {**self._entries.get(path, {}), **data}
+        self._entries[path] = entry
+        await set_yadisk_cache_entry(path, data, self.persistent_ttl)
+
+
+    async def _forget(self, path: str, parents: list[str] | None = None):
+        """
+        Drop the entries of a path and everything under it, including the content entries
+        pointing there, and the entries of the given parent paths.
+        """
+        def is_under(cached_path: str | None) -> bool:
+            return cached_path is not None and (cached_path == path or cached_path.startswith(f'{path}/'))
+
+        for cached_path, entry in list(self._entries.items()):
+            if is_under(cached_path) or is_under(entry.get('path')) or cached_path in (parents or []):
+                self._entries.pop(cached_path, None)
+        await delete_yadisk_cache_entries(path, parents)
+
+    async def _forget_missing(self, path: str):
+        """
+        Drop the entries of a path the Disk reported missing together with the entries
+        of its parent directories, which may be stale too.
+        """
+        parents = []
+        parent = path.rstrip('/')
+        while '/' in parent:
+            parent = parent.rsplit('/', 1)[0]
+            if parent:
+                parents.append(parent)
+        logger.warning(f"Dropping cached Yadisk entries of {path} and its parents")
+        await self._forget(path, parents)
+
+
+    async def publish(self, path: str) -> str | None:
+        entry = await self._get_entry(path)
+        if entry.get('public_url'):
+            return entry['public_url']
+        try:
+            public_url = await self.api.publish(path)
+        except yadisk.exceptions.PathNotFoundError as e:
+            logger.warning(e)
+            await self._forget_missing(path)
+            return None
+        if public_url:
+            await self._set_entry(path, {'public_url': public_url})
+        return public_url
+
+
+    async def remove(self, path: str):
+        await self.api.remove(path)
+        await self._forget(path)
+
+
+    async def download_file(self, disk_path: str, download_path: Path) -> bool:
+        return await self.api.download_file(disk_path, download_path)
+
+
+    async def upload_file(self, local_path: Path, dst_path: str, sha256: str | None = None) -> str | bool | None:
+        """
+        Upload a local file to Yandex Disk. When the content hash is given and the same
+        content was uploaded before, the file is copied on the Disk side instead.
+
+        Args:
+            local_path (Path): Path to the local file.
+            dst_path (str): Destination path on Yandex Disk.
+            sha256 (str | None): SHA-256 of the file content.
+
+        Returns:
+            str: Path to the uploaded file on Yandex Disk.
+        """
+        try:
+            if sha256 is None:
+                return await self.api.upload_file(local_path, dst_path)
+
+            content_key = f'sha256:{sha256}'
+            known_path = (await self._get_entry(content_key)).get('path')
+            if known_path == dst_path:
+                return dst_path
+            if known_path is not None and await self.api.copy(known_path, dst_path):
+                logger.info(f"Copied {known_path} to {dst_path} on Yadisk instead of uploading")
+                return dst_path
+
+            result = await self.api.upload_file(local_path, dst_path)
+            if result:
+                await self._set_entry(content_key, {'path': dst_path})
+            return result
+        except yadisk.exceptions.ParentNotFoundError:
+            # the directories were cached as existing, so the next attempt has to create them again
+            await self._forget_missing(dst_path.rsplit('/', 1)[0] if '/' in dst_path else dst_path)
+            raise
+
+
+    async def create_service_dir(self, path: str):
+        entry = await self._get_entry(path)
+        if entry.get('is_dir'):
+            return
+        await self.api.create_service_dir(path)
+        await self._set_entry(path, {'is_dir': True})
+
+
+def get_async_yadisk_api() -> CachedYandexApi:
+    if yadisk_backend == 'local':
+        api = LocalYandexApi(yadisk_local_root)
+    else:
+        api = AsyncYandexApi(YANDEX_DISK_TOKEN, pool_size=yadisk_pool_size, timeout=yadisk_timeout, upload_timeout=yadisk_upload_timeout)
+    return CachedYandexApi(api, memory_ttl=yadisk_cache_ttl, persistent_ttl=yadisk_cache_persistent_ttl)
+
+
+async_yadisk = get_async_yadisk_api()
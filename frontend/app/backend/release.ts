@@ -1,6 +1,6 @@
 import fastAPI from "./fastapi";
 import type { Author } from "~/types/author";
-import type { NewMusicReleaseUpload, ClipReleaseUpload, BackCatalogReleaseUpload, ReleaseRequest, ReleaseRequestUpdate } from "~/types/release";
+import type { NewMusicReleaseUpload, ClipReleaseUpload, BackCatalogReleaseUpload, ReleaseRequest, ReleaseRequestSummary, ReleaseRequestsPage, ReleaseRequestUpdate, DeliveryJob } from "~/types/release";
 
 
 export async function uploadNewMusicReleaseRequest(
@@ -72,14 +72,14 @@ export async function uploadBackCatalogReleaseRequest(
 }
 
 
-export async function getReleaseRequests(): Promise<ReleaseRequest[]> {
+export async function getReleaseRequests(cursor?: string | null, search?: string): Promise<ReleaseRequestsPage> {
     try {
-        const response = await fastAPI.get('/release/requests')
-        const requests: ReleaseRequest[] = response.data
-        return requests
+        const params = { cursor: cursor ?? undefined, search: search || undefined }
+        const response = await fastAPI.get('/release/requests', { params })
+        return response.data
     } catch (error) {
         console.error('Releases get error:', error);
-        return []
+        return { items: [], nextCursor: null }
     }
 }
 
@@ -104,16 +104,36 @@ export async function updateReleaseRequest(id: string, data: ReleaseRequestUpdat
     }
 }
 
-export async function addReleaseRequestToDeliveryTable(id: string): Promise<number | null> {
+export async function addReleaseRequestToDeliveryTable(id: string): Promise<string | null> {
     try {
         const response = await fastAPI.post(`/release/add-to-delivery/`, {timeout: 100000}, { params: {id} })
-        return response.status
+        return response.data.id
     } catch (error) {
         console.error('Release delivery add error:', error);
         return null
     }
 }
 
+export async function getDeliveryJob(id: string): Promise<DeliveryJob | null> {
+    try {
+        const response = await fastAPI.get(`/release/delivery-jobs/${id}`)
+        return response.data
+    } catch (error) {
+        console.error('Delivery job fetch error:', error);
+        return null
+    }
+}
+
+export async function waitForDeliveryJob(id: string, interval: number = 2000): Promise<DeliveryJob | null> {
+    while (true) {
+        const job = await getDeliveryJob(id)
+        if (job === null || job.status === 'done' || job.status === 'failed') {
+            return job
+        }
+        await new Promise(resolve => setTimeout(resolve, interval))
+    }
+}
+
 export async function addReleaseRequestToDocsTable(id: string) {
     try {
         const response = await fastAPI.post(`/release/add-to-docs/`, {timeout: 100000}, { params: {id} })
@@ -1,9 +1,9 @@
 import type { LinksFunction, LoaderArgs } from "@remix-run/node";
-import { useLoaderData, useNavigate, useRevalidator } from "@remix-run/react";
+import { useLoaderData, useNavigate, useSearchParams } from "@remix-run/react";
 import { useEffect, useState } from "react";
 import styles from "~/styles/admin.request.css";
 import styles2 from "~/styles/admin.requests.css";
-import { getReleaseRequests, addReleaseRequestToDeliveryTable, addReleaseRequestToDocsTable } from "~/backend/release";
+import { getReleaseRequests, addReleaseRequestToDeliveryTable, addReleaseRequestToDocsTable, waitForDeliveryJob } from "~/backend/release";
 import { formatDate } from "~/utils/format";
 
 export const links: LinksFunction = () => {
@@ -11,36 +11,51 @@ export const links: LinksFunction = () => {
 };
 
 export async function loader({ request }: LoaderArgs) {
-    const requests = await getReleaseRequests();
-    return { requests };
+    const search = new URL(request.url).searchParams.get("q") ?? "";
+    const page = await getReleaseRequests(null, search);
+    return { page, search };
 }
 
 export default function Requests() {
     const navigate = useNavigate();
 
     const loadedData = useLoaderData<typeof loader>();
-    const revalidator = useRevalidator();
-    const requests = loadedData.requests
+    const [, setSearchParams] = useSearchParams();
 
-    const [filteredIndices, setFilteredIndices] = useState<number[]>([]);
+    const [requests, setRequests] = useState(loadedData.page.items);
+    const [nextCursor, setNextCursor] = useState(loadedData.page.nextCursor);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
 
-    const [filter, setFilter] = useState("")
+    const [filter, setFilter] = useState(loadedData.search)
     const [modalIsOpened, setModalIsOpened] = useState(false);
 
+    // a new first page replaces whatever was loaded before
     useEffect(() => {
-        const filteredIndices: number[] = []
+        setRequests(loadedData.page.items);
+        setNextCursor(loadedData.page.nextCursor);
+    }, [loadedData]);
 
-        for (let i = 0; i < requests.length; i++) {
-            const releaseData = requests[i].data
-            const joinedFields = releaseData.performers + releaseData.title + requests[i].imprint + requests[i].date;
-            if (joinedFields.toLowerCase().includes(filter.toLowerCase())) {
-                filteredIndices.push(i);
-            }
+    // the search runs on the server, the query goes to the url once typing pauses
+    useEffect(() => {
+        if (filter === loadedData.search) {
+            return
         }
-
-        setFilteredIndices(filteredIndices);
-
-    }, [filter, requests]);
+        const timeout = setTimeout(() => {
+            setSearchParams(filter ? { q: filter } : {}, { replace: true });
+        }, 400);
+        return () => clearTimeout(timeout);
+    }, [filter, loadedData.search, setSearchParams]);
+
+    async function handleLoadMore() {
+        if (nextCursor === null || isLoadingMore) {
+            return
+        }
+        setIsLoadingMore(true);
+        const page = await getReleaseRequests(nextCursor, loadedData.search);
+        setRequests((loaded) => [...loaded, ...page.items]);
+        setNextCursor(page.nextCursor);
+        setIsLoadingMore(false);
+    }
 
 
     async function handleAddRequestToDeliveryTable(id: string, inDeliverySheet: boolean) {
@@ -51,15 +66,20 @@ export default function Requests() {
             }
         }
         setModalIsOpened(true);
-        const result = await addReleaseRequestToDeliveryTable(id);
-        console.log(result)
-        if (result === null) {
+        const jobId = await addReleaseRequestToDeliveryTable(id);
+        const job = jobId ? await waitForDeliveryJob(jobId) : null;
+        console.log(job)
+        if (job === null) {
             setModalIsOpened(false);
             alert('Ошибка')
+        } else if (job.status === 'failed') {
+            setModalIsOpened(false);
+            alert(`Ошибка выгрузки: ${job.error}`)
         } else {
             alert('Релиз добавлен в таблицу выгрузки')
+            // only this row changed, refetching would drop the pages loaded so far
+            setRequests((loaded) => loaded.map((release) => release.id === id ? { ...release, inDeliverySheet: true } : release));
         }
-        revalidator.revalidate();
         setModalIsOpened(false);
     }
 
@@ -76,7 +96,7 @@ export default function Requests() {
         setModalIsOpened(false);
     }
 
-    if (filteredIndices.length === 0) {
+    if (requests.length === 0) {
         return (
             <div className="my-releases">
                 <div className="search-container">
@@ -120,13 +140,8 @@ export default function Requests() {
                 </div>
                 {
                     requests.map((release, index) => {
-
-                        if (!filteredIndices.includes(index)) {
-                            return null
-                        }
-
                         return (
-                            <div key={index} className="release-container" style={{ marginBottom: "1.7vh" }}>
+                            <div key={release.id} className="release-container" style={{ marginBottom: "1.7vh" }}>
 
                                 {/* release performers */}
                                 <div className="row-field" >
@@ -194,6 +209,18 @@ export default function Requests() {
                         )
                     })
                 }
+                {nextCursor !== null && (
+                    <div className="search-container">
+                        <button
+                            onClick={handleLoadMore}
+                            disabled={isLoadingMore}
+                            className={`field release`}
+                            style={{ width: "50%", marginTop: "2vh", borderRadius: "30px", cursor: "pointer" }}
+                        >
+                            {isLoadingMore ? "ЗАГРУЗКА..." : "ЗАГРУЗИТЬ ЕЩЁ"}
+                        </button>
+                    </div>
+                )}
             </div>
         </>
     );
@@ -66,9 +66,37 @@ export interface ReleaseRequest {
     authors: Author[];
 }
 
+export interface ReleaseRequestSummary extends Omit<ReleaseRequest, 'data' | 'authors'> {
+    data: Pick<ReleaseRequest['data'], 'performers' | 'title' | 'version' | 'genre'>;
+}
+
+export interface ReleaseRequestsPage {
+    items: ReleaseRequestSummary[];
+    nextCursor: string | null;
+}
+
 export interface ReleaseRequestUpdate {
     date: string;
     imprint: string;
     cloudLink: string;
     data: NewMusicReleaseUpload | BackCatalogReleaseUpload | ClipReleaseUpload;
 }
+
+export interface DeliveryJobStep {
+    name: string;
+    status: 'running' | 'done' | 'failed' | 'skipped' | 'cancelled';
+    startedAt: string;
+    finishedAt: string | null;
+    error: string | null;
+}
+
+export interface DeliveryJob {
+    id: string;
+    releaseId: string;
+    status: 'queued' | 'running' | 'done' | 'failed';
+    createdAt: string;
+    startedAt: string | null;
+    finishedAt: string | null;
+    steps: DeliveryJobStep[];
+    error: string | null;
+}